@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""agenda.py
+
+Conference Central per-conference agenda snapshots.
+
+The agenda of a conference, all of its sessions sorted by date and start
+time, is stored as one compressed JSON blob in an AgendaSnapshot child of
+the conference. Session writes update it in their own transaction. Reads
+fetch it from memcache together with the version token of the
+conference's sessions (see versions.py) in a single get_multi; a cached
+copy tagged with an older token is ignored. Type, date and time filters
+are then applied in memory. Archived conferences get the snapshot of
+their archived sessions, built on first read.
+
+"""
+
+import json
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import AgendaSnapshot
+from models import ArchivedSession
+from models import Session
+import archive
+import timeindex
+import versions
+
+AGENDA_ID = 'agenda'
+MEMCACHE_AGENDA_TPL = 'AGENDA:%s'
+AGENDA_FIELDS = ('name', 'highlights', 'speaker', 'duration', 'typeOfSession',
+                 'date', 'startTime', 'endTime', 'urlsafeKey')
+KEY_INDEX = AGENDA_FIELDS.index('urlsafeKey')
+
+
+def snapshotKey(c_key):
+    """Return the AgendaSnapshot key of a conference."""
+    return ndb.Key(AgendaSnapshot, AGENDA_ID, parent=c_key)
+
+
+def _sessions(c_key):
+    """Return the sessions of a current or archived conference."""
+    model = ArchivedSession if c_key.kind() == 'ArchivedConference' else Session
+    return model.query(ancestor=c_key)
+
+
+def _row(session):
+    """Return the agenda row of a session, values as SessionForm has them."""
+    values = session.to_dict()
+    if values['endTime'] is None:
+        # sessions written before endTime was derived
+        values['endTime'] = timeindex.endTime(
+            session.startTime, timeindex.parseDuration(session.duration))
+    values['urlsafeKey'] = session.key.urlsafe()
+    return [None if values[name] is None else unicode(values[name])
+            for name in AGENDA_FIELDS]
+
+
+def _sortKey(row):
+    return tuple(row[AGENDA_FIELDS.index(name)] or ''
+                 for name in ('date', 'startTime', 'name'))
+
+
+def _encode(rows):
+    return zlib.compress(json.dumps(rows, separators=(',', ':')))
+
+
+def _decode(data):
+    return json.loads(zlib.decompress(data)) if data else []
+
+
+def _snapshot(c_key, rows):
+    rows.sort(key=_sortKey)
+    return AgendaSnapshot(key=snapshotKey(c_key), data=_encode(rows),
+                          sessionCount=len(rows))
+
+
+def addSessions(c_key, sessions):
+    """Return the agenda snapshot of a conference with sessions added.
+
+    Call it in the transaction writing the sessions and put the result
+    there too.
+    """
+    snapshot = snapshotKey(c_key).get()
+    if snapshot:
+        rows = _decode(snapshot.data)
+    else:
+        rows = [_row(session) for session in _sessions(c_key)]
+    added = set(session.key.urlsafe() for session in sessions)
+    rows = [row for row in rows if row[KEY_INDEX] not in added]
+    rows.extend(_row(session) for session in sessions)
+    return _snapshot(c_key, rows)
+
+
+@ndb.transactional()
+def storeSnapshot(c_key):
+    """Rebuild the agenda snapshot of a conference from its sessions,
+    storing it unless the conference has no sessions."""
+    snapshot = _snapshot(c_key, [_row(session) for session in _sessions(c_key)])
+    if snapshot.sessionCount:
+        snapshot.put()
+    return snapshot
+
+
+def loadAgenda(c_key):
+    """Return the agenda of a conference as a list of dicts of
+    AGENDA_FIELDS, sorted by date and start time."""
+    version_key = versions.MEMCACHE_VERSION_TPL % versions.sessionsScope(c_key)
+    agenda_key = MEMCACHE_AGENDA_TPL % c_key.urlsafe()
+    cached = memcache.get_multi([version_key, agenda_key])
+    token = cached.get(version_key)
+    entry = cached.get(agenda_key)
+    if token and entry and entry[0] == token:
+        data = entry[1]
+    else:
+        # the token was read first, so a session write racing with this
+        # read can only leave the cached copy tagged with an older token
+        snapshot = snapshotKey(c_key).get() or storeSnapshot(c_key)
+        archived_key = archive.archivedKey(c_key)
+        if not snapshot.sessionCount and archived_key != c_key:
+            # ended conferences may have been archived with their sessions
+            snapshot = snapshotKey(archived_key).get() or storeSnapshot(archived_key)
+        data = snapshot.data
+        if token:
+            memcache.set(agenda_key, (token, data))
+    return [dict(zip(AGENDA_FIELDS, row)) for row in _decode(data)]
+
+
+def filterAgenda(agenda, typeOfSession=None, date=None, startTime=None, endTime=None):
+    """Return the sessions of an agenda of a type, on a date, starting at
+    or after startTime and ending by endTime (strings as in SessionForm)."""
+    matching = []
+    for session in agenda:
+        if (startTime or endTime) and not session['startTime']:
+            continue
+        if typeOfSession and session['typeOfSession'] != typeOfSession:
+            continue
+        if date and session['date'] != date:
+            continue
+        if startTime and session['startTime'] < startTime:
+            continue
+        if endTime and (session['endTime'] or session['startTime']) > endTime:
+            continue
+        matching.append(session)
+    return matching
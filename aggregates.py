@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""aggregates.py
+
+Conference Central materialized per-conference statistics.
+
+A ConferenceStats child of each Conference counts its sessions by
+typeOfSession and by speaker, and its attendees. Session creation and
+registration update it in the same transaction as their own writes, so
+the statistics are served with a single key get. A conference without
+statistics (created before they existed) has them computed from its
+sessions the first time they are loaded.
+
+The statistics also hold the next free Session id of the conference, so
+the transaction creating sessions picks their ids without an
+allocate_ids round trip (see takeSessionIds).
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import ConferenceStats
+from models import Session
+
+STATS_ID = 'stats'
+
+
+def statsKey(c_key):
+    """Return the ConferenceStats key of a conference."""
+    return ndb.Key(ConferenceStats, STATS_ID, parent=c_key)
+
+
+def addSessions(stats, sessions):
+    """Count sessions into stats."""
+    type_counts = stats.sessionTypeCounts
+    speaker_counts = stats.speakerCounts
+    for session in sessions:
+        stats.sessionCount += 1
+        if session.typeOfSession:
+            type_counts[session.typeOfSession] = type_counts.get(session.typeOfSession, 0) + 1
+        if session.speaker:
+            speaker_counts[session.speaker] = speaker_counts.get(session.speaker, 0) + 1
+
+
+def takeSessionIds(stats, count):
+    """Return count unused Session ids under the conference of stats.
+
+    Call it in the transaction that writes the sessions and stats; a
+    conference whose stats predate the counter has it started above its
+    existing session ids.
+    """
+    if not stats.nextSessionId:
+        s_keys = Session.query(ancestor=stats.key.parent()).fetch(keys_only=True)
+        stats.nextSessionId = max([s_key.id() for s_key in s_keys
+                                   if isinstance(s_key.id(), (int, long))] + [0]) + 1
+    first = stats.nextSessionId
+    stats.nextSessionId += count
+    return range(first, first + count)
+
+
+@ndb.tasklet
+def buildStatsAsync(conf):
+    """Compute the statistics of a conference from its sessions."""
+    sessions = yield Session.query(ancestor=conf.key).fetch_async()
+    stats = ConferenceStats(key=statsKey(conf.key), sessionCount=0,
+                            sessionTypeCounts={}, speakerCounts={},
+                            attendeeCount=max(0, (conf.maxAttendees or 0)
+                                                 - (conf.seatsAvailable or 0)))
+    addSessions(stats, sessions)
+    raise ndb.Return(stats)
+
+
+@ndb.tasklet
+def loadStatsAsync(conf):
+    """Return the statistics of a conference, computing missing ones.
+
+    Call it in the transaction that updates them; the sessions query is
+    an ancestor query, so it may run there too.
+    """
+    stats = yield statsKey(conf.key).get_async()
+    if not stats:
+        stats = yield buildStatsAsync(conf)
+    raise ndb.Return(stats)
+
+
+def loadStats(conf):
+    """Synchronous loadStatsAsync()."""
+    return loadStatsAsync(conf).get_result()
+
+
+@ndb.transactional()
+def storeStats(conf):
+    """Return the statistics of a conference, storing computed ones."""
+    stats = statsKey(conf.key).get()
+    if not stats:
+        stats = buildStatsAsync(conf).get_result()
+        stats.put()
+    return stats
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""archive.py
+
+Conference Central archival of ended conferences.
+
+Conferences past their endDate, and their sessions, are copied to the
+ArchivedConference and ArchivedSession kinds under the same parent and
+id, and removed from the hot kinds together with everything else stored
+under them (search documents and other derived entities). Hot queries
+and indexes then only cover current and upcoming conferences; archived
+ones are still reachable by key and by queries with includePast.
+Their ConferenceStats are kept, under the archived conference.
+
+"""
+
+from datetime import date
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import ArchivedConference
+from models import ArchivedSession
+from models import Conference
+import aggregates
+import versions
+
+ARCHIVE_BATCH_SIZE = 20
+ARCHIVE_TASK_URL = '/tasks/archive_conferences'
+
+ARCHIVED_KINDS = {
+    'Conference': 'ArchivedConference',
+    'Session': 'ArchivedSession',
+}
+
+# callbacks run with each Conference once it has been archived; they run
+# exactly once, in the transaction that marks the archived copy done
+ON_ARCHIVE = []
+
+
+def archivedKey(key):
+    """Return the key an entity of a hot kind has once archived."""
+    return ndb.Key(pairs=[(ARCHIVED_KINDS.get(kind, kind), id_)
+                          for kind, id_ in key.pairs()])
+
+
+def originalKey(key):
+    """Return the key an archived entity had before it was archived."""
+    current = dict((archived, kind) for kind, archived in ARCHIVED_KINDS.items())
+    return ndb.Key(pairs=[(current.get(kind, kind), id_) for kind, id_ in key.pairs()])
+
+
+def getWithArchive(keys):
+    """Like ndb.get_multi, falling back to the archive for missing
+    Conference and Session entities and those kept under them."""
+    entities = ndb.get_multi(keys)
+    missing = [i for i, (key, entity) in enumerate(zip(keys, entities))
+               if entity is None and archivedKey(key) != key]
+    if missing:
+        archived = ndb.get_multi([archivedKey(keys[i]) for i in missing])
+        for i, entity in zip(missing, archived):
+            entities[i] = entity
+    return entities
+
+
+def archiveConference(conf):
+    """Move a conference and its sessions to the archive kinds.
+
+    Copies are written before the originals are deleted, so an
+    interrupted run is completed by running it again, or, once the
+    originals are gone, by finishArchive().
+    """
+    c_key = conf.key
+    # kindless ancestor query: the conference, its sessions and every
+    # entity derived from them
+    keys = ndb.Query(ancestor=c_key).fetch(keys_only=True)
+    stats_key = archivedKey(aggregates.statsKey(c_key))
+    fetched = ndb.get_multi([archivedKey(c_key), stats_key] +
+                            [key for key in keys if key.kind() == 'Session'])
+    archived, archived_stats, sessions = fetched[0], fetched[1], fetched[2:]
+
+    copy = ArchivedConference(key=archivedKey(c_key), **conf.to_dict())
+    copy.callbacksDone = bool(archived and archived.callbacksDone)
+    copies = [copy]
+    copies.extend(ArchivedSession(key=archivedKey(sess.key), **sess.to_dict())
+                  for sess in sessions if sess)
+    # stats copied by an earlier run are kept: the hot ones may since
+    # have lost some of the children they count
+    if not archived_stats:
+        stats = aggregates.loadStats(conf)
+        stats.key = stats_key
+        copies.append(stats)
+    ndb.put_multi(copies)
+    # the conference goes in the same, last, call so a retry still finds
+    # it until everything under it is gone
+    ndb.delete_multi(keys)
+    versions.bump(versions.conferenceScope(c_key), versions.sessionsScope(c_key))
+    finishArchive(copy.key)
+
+
+@ndb.transactional(xg=True)
+def finishArchive(a_key):
+    """Run the ON_ARCHIVE callbacks of an archived conference unless they
+    already ran."""
+    archived = a_key.get()
+    if not archived or archived.callbacksDone in (None, True):
+        return
+    values = archived.to_dict(exclude=['callbacksDone'])
+    conf = Conference(key=originalKey(a_key), **values)
+    for callback in ON_ARCHIVE:
+        callback(conf)
+    archived.callbacksDone = True
+    archived.put()
+
+
+def archiveEndedConferences(today=None):
+    """Archive a batch of ended conferences, chaining a task while more
+    remain; returns the number archived."""
+    today = today or date.today()
+    # null endDates sort first; the lower bound keeps them from filling
+    # every batch
+    ended = Conference.query(Conference.endDate > date.min,
+                             Conference.endDate < today).fetch(ARCHIVE_BATCH_SIZE)
+    for conf in ended:
+        archiveConference(conf)
+    # conferences whose archival was interrupted after their deletion
+    pending = ArchivedConference.query(
+        ArchivedConference.callbacksDone == False).fetch(
+            ARCHIVE_BATCH_SIZE, keys_only=True)
+    for a_key in pending:
+        finishArchive(a_key)
+    if len(ended) == ARCHIVE_BATCH_SIZE:
+        taskqueue.add(url=ARCHIVE_TASK_URL)
+    return len(ended)
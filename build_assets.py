@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+"""build_assets.py
+
+Bundle the web client's static assets for deployment.
+
+The JavaScript (app.js, controllers.js and every Angular partial, put in
+the $templateCache so routes and modals never fetch them) and the CSS are
+each concatenated, minified and written to static/assets under a name
+holding a hash of their content. templates/index.html then loads the two
+bundles, which app.yaml serves with a far-future expiration: a changed
+file gets a new name, so clients only refetch what changed.
+
+    python build_assets.py          # write the bundles, point index.html
+                                    # and app.yaml at them
+    python build_assets.py --dev    # point index.html back at the
+                                    # unbundled sources
+
+The tool rewrites the sections between the build_assets markers in
+templates/index.html and app.yaml, and removes stale bundles.
+
+"""
+
+import glob
+import hashlib
+import json
+import optparse
+import os
+import re
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = 'static/assets'
+ASSETS_URL = '/assets'
+INDEX_HTML = 'templates/index.html'
+APP_YAML = 'app.yaml'
+HASH_LENGTH = 10
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+ANGULAR_MODULE = 'conferenceApp'
+# (source file, URL it is served at unbundled)
+JS_FILES = [
+    ('static/js/app.js', '/js/app.js'),
+    ('static/js/controllers.js', '/js/controllers.js'),
+]
+CSS_FILES = [
+    ('static/bootstrap/css/bootstrap-cosmo.css', '/css/bootstrap-cosmo.css'),
+    ('static/bootstrap/css/main.css', '/css/main.css'),
+    ('static/bootstrap/css/offcanvas.css', '/css/offcanvas.css'),
+]
+PARTIALS = ('static/partials/*.html', '/partials/')
+
+HTML_MARKERS = ('<!-- BEGIN build_assets %s -->', '<!-- END build_assets %s -->')
+YAML_MARKERS = ('# BEGIN build_assets', '# END build_assets')
+
+# characters after which a slash starts a regular expression literal
+REGEX_PRECEDERS = '(,=:[!&|?{};+-*%<>~^\n'
+
+
+def _read(path):
+    with open(os.path.join(ROOT, path), 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def _write(path, text):
+    with open(os.path.join(ROOT, path), 'wb') as f:
+        f.write(text.encode('utf-8'))
+
+
+def _lastChar(out):
+    """Return the last non-blank character written, or a newline."""
+    for chunk in reversed(out):
+        chunk = chunk.rstrip(' \t')
+        if chunk:
+            return chunk[-1]
+    return '\n'
+
+
+def minifyJs(source):
+    """Strip comments, indentation and blank lines from JavaScript.
+
+    Line breaks are kept, so automatic semicolon insertion is unaffected.
+    """
+    out = []
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c in '\'"':
+            end = i + 1
+            while end < n and source[end] != c:
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        elif source.startswith('//', i):
+            i = source.find('\n', i)
+            i = n if i < 0 else i
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            out.append(' ')
+        elif c == '/' and _lastChar(out) in REGEX_PRECEDERS:
+            end, in_class = i + 1, False
+            while end < n and (in_class or source[end] != '/'):
+                if source[end] == '\\':
+                    end += 1
+                elif source[end] in '[]':
+                    in_class = source[end] == '['
+                end += 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        else:
+            out.append(c)
+            i += 1
+    lines = [line.strip() for line in ''.join(out).split('\n')]
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def minifyCss(source):
+    """Strip comments and redundant whitespace from CSS."""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,])\s*', r'\1', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def templateCache():
+    """Return JavaScript putting every partial in the Angular $templateCache."""
+    pattern, url = PARTIALS
+    puts = []
+    for path in sorted(glob.glob(os.path.join(ROOT, pattern))):
+        name = os.path.basename(path)
+        html = _read(os.path.relpath(path, ROOT))
+        puts.append('$templateCache.put(%s,%s);' % (
+            json.dumps(url + name), json.dumps(re.sub(r'\n\s+', '\n', html.strip()))))
+    return ("angular.module(%s).run(['$templateCache',function($templateCache){\n%s\n}]);\n"
+            % (json.dumps(ANGULAR_MODULE), '\n'.join(puts)))
+
+
+def bundleJs():
+    return ''.join(minifyJs(_read(path)) for path, _ in JS_FILES) + templateCache()
+
+
+def bundleCss():
+    # every source lives one directory below the site root, like the
+    # bundle, so relative urls keep resolving
+    return ''.join(minifyCss(_read(path)) for path, _ in CSS_FILES)
+
+
+def fingerprint(name, ext, text):
+    """Return the file name of a bundle, holding a hash of its content."""
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:HASH_LENGTH]
+    return '%s.%s.%s' % (name, digest, ext)
+
+
+def replaceSection(text, begin, end, body):
+    """Replace the lines between the begin and end marker lines."""
+    start = text.index(begin)
+    stop = text.index(end, start)
+    indent = text[text.rindex('\n', 0, start) + 1:start]
+    return text[:start] + begin + '\n' + ''.join(
+        indent + line + '\n' for line in body) + indent + text[stop:]
+
+
+def _cssTags(urls):
+    return ['<link rel="stylesheet" href="%s">' % url for url in urls]
+
+
+def _jsTags(urls):
+    return ['<script src="%s"></script>' % url for url in urls]
+
+
+def writeIndexHtml(css_urls, js_urls):
+    text = _read(INDEX_HTML)
+    for name, tags in (('css', _cssTags(css_urls)), ('js', _jsTags(js_urls))):
+        begin, end = [marker % name for marker in HTML_MARKERS]
+        text = replaceSection(text, begin, end, tags)
+    _write(INDEX_HTML, text)
+
+
+def writeAppYaml():
+    handler = [
+        '- url: %s' % ASSETS_URL,
+        '  static_dir: %s' % ASSETS_DIR,
+        '  expiration: "365d"',
+        '  http_headers:',
+        '    Cache-Control: public, max-age=%d, immutable' % CACHE_MAX_AGE,
+    ]
+    text = _read(APP_YAML)
+    _write(APP_YAML, replaceSection(text, YAML_MARKERS[0], YAML_MARKERS[1], handler))
+
+
+def build():
+    """Write the bundles and point index.html and app.yaml at them."""
+    js, css = bundleJs(), bundleCss()
+    bundles = [fingerprint('app', 'js', js), fingerprint('style', 'css', css)]
+    if not os.path.isdir(os.path.join(ROOT, ASSETS_DIR)):
+        os.makedirs(os.path.join(ROOT, ASSETS_DIR))
+    for name, text in zip(bundles, [js, css]):
+        _write(os.path.join(ASSETS_DIR, name), text)
+    for path in glob.glob(os.path.join(ROOT, ASSETS_DIR, '*')):
+        if os.path.basename(path) not in bundles:
+            os.remove(path)
+    writeIndexHtml(['%s/%s' % (ASSETS_URL, bundles[1])],
+                   ['%s/%s' % (ASSETS_URL, bundles[0])])
+    writeAppYaml()
+    return bundles
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [--dev]')
+    parser.add_option('--dev', action='store_true',
+                      help='load the unbundled sources from index.html')
+    options, _ = parser.parse_args(argv)
+
+    if options.dev:
+        writeIndexHtml([url for _, url in CSS_FILES], [url for _, url in JS_FILES])
+        sys.stderr.write('index.html loads the unbundled sources\n')
+        return
+    for name in build():
+        size = os.path.getsize(os.path.join(ROOT, ASSETS_DIR, name))
+        sys.stderr.write('%s/%s (%d bytes)\n' % (ASSETS_DIR, name, size))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""compact.py
+
+Conference Central compact encodings of list responses.
+
+ConferenceForms and SessionForms can be returned as protobuf binary in
+the payload field, or as columnar JSON in the columnar field, instead of
+as a JSON list of objects. The columnar variant lists each field once and
+deduplicates values within a column:
+
+    {"field": "items", "count": 3, "columns": {
+        "city": {"dict": ["London", "Paris"], "index": [0, 0, 1]},
+        "websafeKey": {"prefix": "ahVkZXZ-", "values": ["...", ...]},
+        "seatsAvailable": [10, 0, 4]}}
+
+"""
+
+import json
+
+from protorpc import protobuf
+
+from models import ResponseEncoding
+
+LIST_FIELDS = ('items', 'summaries')
+MIN_PREFIX = 8
+
+
+def _commonPrefix(values):
+    """Return the longest common prefix of a list of strings."""
+    if not values:
+        return ''
+    low, high = min(values), max(values)
+    length = 0
+    while length < len(low) and low[length] == high[length]:
+        length += 1
+    return low[:length]
+
+
+def encodeColumn(values):
+    """Return the smallest columnar encoding of a list of values."""
+    hashable = [tuple(v) if isinstance(v, list) else v for v in values]
+    distinct = []
+    index = {}
+    for value, key in zip(values, hashable):
+        if key not in index:
+            index[key] = len(distinct)
+            distinct.append(value)
+    if len(distinct) * 2 <= len(values):
+        return {'dict': distinct, 'index': [index[key] for key in hashable]}
+
+    strings = [v for v in values if isinstance(v, basestring)]
+    if len(strings) == len(values):
+        prefix = _commonPrefix(strings)
+        if len(prefix) >= MIN_PREFIX:
+            return {'prefix': prefix,
+                    'values': [v[len(prefix):] for v in strings]}
+    return values
+
+
+def _columnar(forms):
+    """Return the columnar JSON text of the list field of forms."""
+    for name in LIST_FIELDS:
+        items = getattr(forms, name)
+        if items:
+            break
+    else:
+        return json.dumps({'count': 0}, separators=(',', ':'))
+    columns = {}
+    for field in items[0].all_fields():
+        values = [getattr(item, field.name) for item in items]
+        if field.repeated:
+            values = [list(v) for v in values]
+        if any(v not in (None, []) for v in values):
+            columns[field.name] = encodeColumn(values)
+    return json.dumps({'field': name, 'count': len(items), 'columns': columns},
+                      separators=(',', ':'))
+
+
+def encodeForms(forms, encoding):
+    """Re-encode the items and summaries of a ConferenceForms or
+    SessionForms message in place, returning it."""
+    if encoding in (None, ResponseEncoding.JSON):
+        return forms
+    if encoding == ResponseEncoding.PROTOBUF:
+        lists = type(forms)()
+        for name in LIST_FIELDS:
+            setattr(lists, name, getattr(forms, name))
+        forms.payload = protobuf.encode_message(lists)
+    else:
+        forms.columnar = _columnar(forms)
+    for name in LIST_FIELDS:
+        setattr(forms, name, [])
+    forms.encoding = encoding
+    return forms
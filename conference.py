@@ -13,6 +13,8 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+import collections
+import logging
 from datetime import datetime
 
 import endpoints
@@ -22,6 +24,7 @@ from protorpc import remote
 
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.ext import db
 from google.appengine.ext import ndb
 
 from models import ConflictException
@@ -31,11 +34,25 @@ from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
+from models import ArchivedConference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceKeysForm
+from models import RegistrationForm
+from models import RegistrationForms
+from models import SearchResultForm
+from models import SearchResultForms
 from models import TeeShirtSize
+from models import ListView
+from models import ResponseEncoding
+from models import ConferenceSummaryForm
+from models import ConferenceDetailForm
+from models import ConferenceStatsForm
+from models import ConferenceFacetsForm
+from models import FacetCountForm
+from models import TypeCountForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -43,8 +60,22 @@ from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
+import search
+import versions
+import compact
+import timeindex
+import archive
+import aggregates
+import schedule
+import topics
+import ratelimit
+import agenda
+import traffic
+import idalloc
+import facets
 from models import SessionForm
 from models import SessionForms
+from models import SessionSummaryForm
 from models import Session
 from models import SessionWishlist
 
@@ -56,6 +87,12 @@ ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
 MEMCACHE_FEATUREDSPKR_KEY = "FEATURED_SPEAKER"
 SPKR_TPL = ('These sessions will have our featured speaker %s: %s, %s')
 SPEAKER = " "
+MAX_BATCH_SIZE = 500
+XG_MAX_ENTITY_GROUPS = 25
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+BUCKET_PAGE_SIZE = 1000
+MAX_SESSIONS_PER_COMMIT = 200
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -75,6 +112,13 @@ OPERATORS = {
             'NE':   '!='
             }
 
+# fields of the SUMMARY view, served by projection queries
+CONF_SUMMARY_FIELDS = ('name', 'city', 'startDate', 'endDate', 'seatsAvailable')
+SESSION_SUMMARY_FIELDS = ('name', 'speaker', 'typeOfSession', 'date', 'startTime')
+# SessionForm fields copied to a new Session
+SESSION_FORM_FIELDS = ('name', 'highlights', 'speaker', 'duration',
+                       'typeOfSession', 'date', 'startTime')
+
 FIELDS =    {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -87,6 +131,29 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    view=messages.EnumField(ListView, 1, default='FULL'),
+    encoding=messages.EnumField(ResponseEncoding, 2, default='JSON'),
+)
+
+CONF_ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
+ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+CONF_DETAIL_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -97,30 +164,84 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    view=messages.EnumField(ListView, 2, default='FULL'),
+    ifNoneMatch=messages.StringField(3),
+    encoding=messages.EnumField(ResponseEncoding, 4, default='JSON'),
+    date=messages.StringField(5),
+    startTime=messages.StringField(6),
+    endTime=messages.StringField(7),
+    pageSize=messages.IntegerField(8),
+    pageToken=messages.StringField(9),
 )
 
 SESSIONTYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
     sessionType=messages.StringField(2),
+    view=messages.EnumField(ListView, 3, default='FULL'),
+    encoding=messages.EnumField(ResponseEncoding, 4, default='JSON'),
 )
 
 SESSIONNAME_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     name=messages.StringField(1),
+    view=messages.EnumField(ListView, 2, default='FULL'),
+    encoding=messages.EnumField(ResponseEncoding, 3, default='JSON'),
     )
 
 SESSIONSDATE = endpoints.ResourceContainer(
     message_types.VoidMessage,
     sdate=messages.StringField(1),
+    view=messages.EnumField(ListView, 2, default='FULL'),
+    encoding=messages.EnumField(ResponseEncoding, 3, default='JSON'),
+    )
+
+SESSIONWINDOW_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    date=messages.StringField(1),
+    startTime=messages.StringField(2),
+    endTime=messages.StringField(3),
+    websafeConferenceKey=messages.StringField(4),
     )
 
 SESSIONSPKR_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speaker=messages.StringField(1),
+    view=messages.EnumField(ListView, 2, default='FULL'),
+    encoding=messages.EnumField(ResponseEncoding, 3, default='JSON'),
+    )
+
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    kind=messages.StringField(2),
+    pageSize=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
+    )
+
+TOPICS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    topics=messages.StringField(1, repeated=True),
+    matchAll=messages.BooleanField(2, default=True),
+    )
+
+FACETS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    field=messages.StringField(1),
+    value=messages.StringField(2),
+    )
+
+RELATED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    limit=messages.IntegerField(1),
     )
 
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
@@ -134,6 +255,7 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
 @endpoints.api(name='conference', version='v1', audiences=[ANDROID_AUDIENCE],
     allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID],
     scopes=[EMAIL_SCOPE])
+@traffic.recorded
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
@@ -157,14 +279,22 @@ class ConferenceApi(remote.Service):
         return cf
 
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    def _copyConferenceToSummary(self, conf):
+        """Copy summary fields from (projected) Conference to ConferenceSummaryForm."""
+        cs = ConferenceSummaryForm()
+        for name in CONF_SUMMARY_FIELDS:
+            # convert Date to date string; just copy others
+            if name.endswith('Date'):
+                setattr(cs, name, str(getattr(conf, name)))
+            else:
+                setattr(cs, name, getattr(conf, name))
+        cs.websafeKey = conf.key.urlsafe()
+        cs.check_initialized()
+        return cs
+
 
+    def _conferenceDataFromForm(self, request, user_id):
+        """Validate ConferenceForm, returning dict of Conference properties."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
@@ -172,6 +302,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -180,28 +312,53 @@ class ConferenceApi(remote.Service):
                 setattr(request, df, DEFAULTS[df])
 
         # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Conference '%s' has an invalid date" % request.name)
 
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        data['organizerUserId'] = request.organizerUserId = user_id
+        return data
+
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        data = self._conferenceDataFromForm(request, user_id)
+
         # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
+        # ID from the Profile's counter, get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
 
         # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        # creation of Conference & return (modified) ConferenceForm;
+        # the conference, its search document and the counter are written
+        # together, counted in a facet shard
+        @ndb.transactional(xg=True)
+        def write():
+            counter = idalloc.loadCounter(Conference, p_key)
+            c_id = idalloc.takeIds(counter)[0]
+            conf = Conference(key=ndb.Key(Conference, c_id, parent=p_key), **data)
+            ndb.put_multi([conf, counter, search.buildDocument(conf),
+                           facets.changedShard([], [facets.facetValues(conf)])])
+            return conf
+
+        conf = write()
+        topics.reindexConferences([conf.key])
         taskqueue.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
@@ -209,7 +366,43 @@ class ConferenceApi(remote.Service):
         return request
 
 
-    @ndb.transactional()
+    def _createConferenceObjects(self, request):
+        """Create a batch of Conference objects, returning ConferenceForms."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        if not request.items:
+            raise endpoints.BadRequestException("At least one conference required")
+        if len(request.items) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                "At most %d conferences may be created at once" % MAX_BATCH_SIZE)
+
+        # validate the whole batch before anything is written
+        datas = [self._conferenceDataFromForm(cf, user_id) for cf in request.items]
+
+        # ids for the whole batch from the Profile's counter, all
+        # Conferences are children of Profile
+        p_key = ndb.Key(Profile, user_id)
+        confs = []
+        for c_id, data, cf in zip(idalloc.reserveIds(Conference, p_key, len(datas)),
+                                  datas, request.items):
+            data['key'] = ndb.Key(Conference, c_id, parent=p_key)
+            cf.websafeKey = data['key'].urlsafe()
+            confs.append(Conference(**data))
+        ndb.put_multi(confs + [search.buildDocument(conf) for conf in confs])
+        facets.storeChange([], [facets.facetValues(conf) for conf in confs])
+        topics.reindexConferences([conf.key for conf in confs])
+
+        # a single confirmation email covers the whole batch
+        taskqueue.add(params={'email': user.email(),
+            'conferenceInfo': '\r\n\r\n'.join(repr(cf) for cf in request.items)},
+            url='/tasks/send_confirmation_email'
+        )
+        return request
+
+
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -231,6 +424,9 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        old_topics = list(conf.topics)
+        old_facets = facets.facetValues(conf)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
@@ -244,7 +440,12 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
+        # the facet shard is a second entity group
+        shard = facets.changedShard([old_facets], [facets.facetValues(conf)])
+        ndb.put_multi([conf, search.buildDocument(conf)] + ([shard] if shard else []))
+        versions.bump(versions.conferenceScope(conf.key))
+        if set(conf.topics) != set(old_topics):
+            topics.reindexConferences([conf.key], old_topics, transactional=True)
         prof = ndb.Key(Profile, user_id).get()
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
@@ -256,6 +457,13 @@ class ConferenceApi(remote.Service):
         return self._createConferenceObject(request)
 
 
+    @endpoints.method(ConferenceForms, ConferenceForms, path='conferences',
+            http_method='POST', name='createConferences')
+    def createConferences(self, request):
+        """Create a batch of new conferences."""
+        return self._createConferenceObjects(request)
+
+
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
@@ -264,22 +472,129 @@ class ConferenceApi(remote.Service):
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    def _ifNoneMatch(self, request):
+        """Return the ETag the client already has, if any."""
+        if request.ifNoneMatch:
+            return request.ifNoneMatch
+        headers = getattr(self.request_state, 'headers', None)
+        return headers.get('If-None-Match') if headers else None
+
+
+    @endpoints.method(CONF_ETAG_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # the conference and its organizer's display name make up the
+        # response; compare versions before reading either
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        etag = versions.etag([versions.conferenceScope(c_key),
+                              versions.profileScope(c_key.parent().id())])
+        if self._ifNoneMatch(request) == etag:
+            return ConferenceForm(etag=etag, notModified=True)
+        # get Conference object from request, which may have been
+        # archived; bail if not found
+        conf = archive.getWithArchive([c_key])[0]
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
         prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf.etag = etag
+        return cf
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_DETAIL_GET_REQUEST, ConferenceDetailForm,
+            path='conference/{websafeConferenceKey}/detail',
+            http_method='GET', name='getConferenceDetail')
+    @ratelimit.limited
+    def getConferenceDetail(self, request):
+        """Return conference, organizer, the caller's registration and
+        wishlist status and the first page of sessions in one response.
+
+        Sessions come in agenda order; nextPageToken is the pageToken of
+        getConferenceSessions for the rest of them.
+        """
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+        # every RPC only depends on the conference key, so issue them all
+        # at once; the agenda is read from memcache meanwhile
+        conf_future = c_key.get_async()
+        organizer_future = c_key.parent().get_async()
+        user = endpoints.get_current_user()
+        if user:
+            p_key = ndb.Key(Profile, getUserId(user))
+            profile_future = p_key.get_async()
+            wishlist_future = SessionWishlist.query(ancestor=p_key).fetch_async()
+        sessions = agenda.loadAgenda(c_key)
+
+        conf = conf_future.get_result()
+        if not conf and archive.archivedKey(c_key) != c_key:
+            # ended conferences may have been archived; the agenda already
+            # falls back to their archived sessions
+            c_key = archive.archivedKey(c_key)
+            conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        organizer = organizer_future.get_result()
+        page = sessions[:page_size]
+        detail = ConferenceDetailForm(
+            conference=self._copyConferenceToForm(conf, getattr(organizer, 'displayName', None)),
+            isRegistered=False,
+            sessions=self._agendaForms(page, ListView.FULL).items,
+            nextPageToken=str(page_size) if len(sessions) > page_size else None)
+        if user:
+            prof = profile_future.get_result()
+            # profiles and wishlists hold the keys entities had before
+            # being archived
+            detail.isRegistered = bool(prof) and \
+                archive.originalKey(c_key).urlsafe() in prof.conferenceKeysToAttend
+            # the whole agenda is at hand, so flag sessions of later pages too
+            session_keys = {}
+            for session in sessions:
+                s_key = ndb.Key(urlsafe=session['urlsafeKey'])
+                session_keys[archive.originalKey(s_key).urlsafe()] = session['urlsafeKey']
+            detail.wishlistSessionKeys = [session_keys[wish.sessionKey]
+                                          for wish in wishlist_future.get_result()
+                                          if wish.sessionKey in session_keys]
+        return detail
+
+
+    def _copyStatsToForm(self, stats, wsck):
+        """Copy relevant fields from ConferenceStats to ConferenceStatsForm."""
+        type_counts = stats.sessionTypeCounts or {}
+        return ConferenceStatsForm(
+            websafeConferenceKey=wsck,
+            sessionCount=stats.sessionCount,
+            attendeeCount=stats.attendeeCount,
+            speakerCount=len(stats.speakerCounts or {}),
+            sessionTypes=[TypeCountForm(typeOfSession=name, count=type_counts[name])
+                          for name in sorted(type_counts)])
+
+
+    @endpoints.method(CONF_GET_REQUEST, ConferenceStatsForm,
+            path='conference/{websafeConferenceKey}/stats',
+            http_method='GET', name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """Return session, speaker and attendee counts of a conference."""
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        # stats are kept up to date by session creation and registration,
+        # so a single batch get serves them
+        stats, conf = archive.getWithArchive([aggregates.statsKey(c_key), c_key])
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if not stats:
+            stats = aggregates.storeStats(conf)
+        return self._copyStatsToForm(stats, wsck)
+
+
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
@@ -290,33 +605,96 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        # create ancestor queries for all key matches for this user,
+        # ended conferences included
+        p_key = ndb.Key(Profile, user_id)
+        queries = [model.query(ancestor=p_key)
+                   for model in (Conference, ArchivedConference)]
+        if request.view == ListView.SUMMARY:
+            futures = [query.fetch_async(projection=CONF_SUMMARY_FIELDS)
+                       for query in queries]
+            return compact.encodeForms(ConferenceForms(
+                summaries=[self._copyConferenceToSummary(conf) for future in futures
+                           for conf in future.get_result()]
+            ), request.encoding)
+        futures = [query.fetch_async() for query in queries]
+        prof = p_key.get()
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        return compact.encodeForms(ConferenceForms(
+            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+                   for future in futures for conf in future.get_result()]
+        ), request.encoding)
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _queryConferences(self, request):
+        """Return conferences matching the submitted filters, sorted by name.
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        Only the inequality filter, if any, runs as a sorted query, which
+        needs a single (field, name) composite index per field. Equality
+        filters run as keys-only single-property scans that are
+        merge-joined with it in memory, so no composite index is needed
+        per combination of filters (see index_advisor.py).
+        """
+        inequality_filter, filters = self._formatFilters(request.filters)
 
         for filtr in filters:
             if filtr["field"] in ["month", "maxAttendees"]:
                 filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+
+        conferences = self._filterConferences(Conference, inequality_filter, filters)
+        if not request.includePast:
+            return conferences
+
+        # archived conferences live in their own kind; merge both results
+        conferences += self._filterConferences(ArchivedConference, inequality_filter, filters)
+        if inequality_filter and inequality_filter != 'topics':
+            conferences.sort(key=lambda conf: (getattr(conf, inequality_filter), conf.name))
+        else:
+            conferences.sort(key=lambda conf: conf.name)
+        return conferences
+
+
+    def _filterConferences(self, model, inequality_filter, filters):
+        """Return entities of a Conference kind matching formatted filters."""
+        # run every scan in parallel; the sorted scan drives the result order
+        scans = []
+        for filtr in filters:
+            if filtr["field"] != inequality_filter:
+                formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
+                scans.append(model.query(formatted_query).fetch_async(keys_only=True))
+        if not inequality_filter:
+            if scans:
+                ordered = None
+            else:
+                ordered = model.query().order(model.name).fetch_async(keys_only=True)
+        else:
+            q = model.query()
+            for filtr in filters:
+                if filtr["field"] == inequality_filter:
+                    formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
+                    q = q.filter(formatted_query)
+            q = q.order(ndb.GenericProperty(inequality_filter))
+            q = q.order(model.name)
+            ordered = q.fetch_async(keys_only=True)
+
+        # merge-join the equality scans
+        matching = None
+        for scan in scans:
+            keys = set(scan.get_result())
+            matching = keys if matching is None else matching & keys
+        if ordered is None:
+            conferences = [conf for conf in ndb.get_multi(matching) if conf]
+            conferences.sort(key=lambda conf: conf.name)
+            return conferences
+        # keep the sorted scan's order; an inequality on a repeated
+        # property can return the same key more than once
+        keys = []
+        seen = set()
+        for key in ordered.get_result():
+            if key not in seen and (matching is None or key in matching):
+                seen.add(key)
+                keys.append(key)
+        return [conf for conf in ndb.get_multi(keys) if conf]
 
 
     def _formatFilters(self, filters):
@@ -351,9 +729,19 @@ class ConferenceApi(remote.Service):
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @ratelimit.limited
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        if request.view == ListView.SUMMARY:
+            if request.filters or request.includePast:
+                conferences = self._queryConferences(request)
+            else:
+                conferences = Conference.query().order(Conference.name).fetch(
+                    projection=CONF_SUMMARY_FIELDS)
+            return compact.encodeForms(ConferenceForms(
+                summaries=[self._copyConferenceToSummary(conf) for conf in conferences]
+            ), request.encoding)
+        conferences = self._queryConferences(request)
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
@@ -366,10 +754,104 @@ class ConferenceApi(remote.Service):
             names[profile.key.id()] = profile.displayName
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
+        return compact.encodeForms(ConferenceForms(
                 items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
                 conferences]
-        )
+        ), request.encoding)
+
+
+    def _conferencesToForms(self, conferences):
+        """Return ConferenceForms of conferences with organizer names."""
+        organisers = ndb.get_multi(
+            [ndb.Key(Profile, conf.organizerUserId) for conf in conferences])
+        names = dict((profile.key.id(), profile.displayName)
+                     for profile in organisers if profile)
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+                   for conf in conferences])
+
+
+    @endpoints.method(TOPICS_GET_REQUEST, ConferenceForms,
+            path='conferences/topics',
+            http_method='GET', name='queryConferencesByTopics')
+    @ratelimit.limited
+    def queryConferencesByTopics(self, request):
+        """Return current conferences having all (matchAll) or any of topics."""
+        if not request.topics:
+            raise endpoints.BadRequestException("At least one topic required")
+        # one get for the topic index entries, then one for the conferences
+        keys = topics.conferencesWithTopics(request.topics, request.matchAll)
+        conferences = [conf for conf in ndb.get_multi(keys) if conf]
+        conferences.sort(key=lambda conf: conf.name)
+        return self._conferencesToForms(conferences)
+
+
+    @endpoints.method(FACETS_GET_REQUEST, ConferenceFacetsForm,
+            path='conferences/facets',
+            http_method='GET', name='getConferenceFacets')
+    @ratelimit.limited
+    def getConferenceFacets(self, request):
+        """Return the number of current conferences with each city, topic,
+        month and maxAttendees value, within an optional equality filter."""
+        field = None
+        if request.field:
+            if request.field not in FIELDS or not request.value:
+                raise endpoints.BadRequestException(
+                    "Filter requires a valid field and a value.")
+            field = FIELDS[request.field]
+        names = dict((name, fname) for fname, name in FIELDS.items())
+        # the counts are served from memcache, else from one get of all shards
+        total, rows = facets.facetCounts(facets.loadFacets(), field, request.value)
+        return ConferenceFacetsForm(
+            field=request.field, value=request.value if field else None,
+            total=total,
+            counts=[FacetCountForm(field=names[fname], value=value, count=count)
+                    for fname, value, count in rows])
+
+
+    @endpoints.method(RELATED_GET_REQUEST, ConferenceForms,
+            path='conferences/related',
+            http_method='GET', name='getRelatedConferences')
+    def getRelatedConferences(self, request):
+        """Return conferences sharing the most topics with those the user
+        registered for."""
+        prof = self._getProfileFromUser() # get user Profile
+        limit = min(request.limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        # conferences that have ended may have been archived
+        attending = [conf for conf in archive.getWithArchive(
+            [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]) if conf]
+        keys = topics.relatedConferences(attending, limit)
+        # keep the ranking; the index may briefly trail deletions
+        return self._conferencesToForms(
+            [conf for conf in ndb.get_multi(keys) if conf])
+
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(SEARCH_GET_REQUEST, SearchResultForms,
+            path='search',
+            http_method='GET', name='search')
+    @ratelimit.limited
+    def fullTextSearch(self, request):
+        """Search conference and session names, descriptions, highlights
+        and speakers by word prefix, best matches first."""
+        if request.kind not in (None, 'Conference', 'Session'):
+            raise endpoints.BadRequestException(
+                "Search kind must be 'Conference' or 'Session'")
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid pageToken")
+
+        hits, more = search.search(request.query, kind=request.kind,
+                                   offset=offset, limit=page_size)
+        return SearchResultForms(
+            items=[SearchResultForm(kind=doc.docKind,
+                                    websafeKey=doc.key.parent().urlsafe(),
+                                    name=doc.name, score=score)
+                   for doc, score in hits],
+            nextPageToken=str(offset + page_size) if more else None)
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
@@ -430,6 +912,7 @@ class ConferenceApi(remote.Service):
                         #else:
                         #    setattr(prof, field, val)
                         prof.put()
+                        versions.bump(versions.profileScope(prof.key.id()))
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -460,6 +943,7 @@ class ConferenceApi(remote.Service):
             Conference.seatsAvailable <= 5,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
+        previous = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or ""
 
         if confs:
             # If there are almost sold out conferences,
@@ -473,15 +957,21 @@ class ConferenceApi(remote.Service):
             announcement = ""
             memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
 
+        if announcement != previous:
+            versions.bump(versions.ANNOUNCEMENT_SCOPE)
         return announcement
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(ETAG_GET_REQUEST, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        etag = versions.etag([versions.ANNOUNCEMENT_SCOPE])
+        if self._ifNoneMatch(request) == etag:
+            return StringMessage(data="", etag=etag, notModified=True)
+        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "",
+                             etag=etag)
 
 
 # - - - Featured Speaker - - - - - - - - - - - - - - - - - - - -
@@ -501,16 +991,21 @@ class ConferenceApi(remote.Service):
         speaker_announcement = SPKR_TPL % (featured_speaker,
                 ','.join(sess.name for sess in featured_sessions), fspkr)
         memcache.set(MEMCACHE_FEATUREDSPKR_KEY, speaker_announcement)
+        versions.bump(versions.FEATURED_SPEAKER_SCOPE)
         return speaker_announcement
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(ETAG_GET_REQUEST, StringMessage,
             path='sessions/featuredspeaker/get',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """Return Featured Sessions and speakers from memcache."""
         #TASK 4
-        return StringMessage(data=memcache.get(MEMCACHE_FEATUREDSPKR_KEY) or "")
+        etag = versions.etag([versions.FEATURED_SPEAKER_SCOPE])
+        if self._ifNoneMatch(request) == etag:
+            return StringMessage(data="", etag=etag, notModified=True)
+        return StringMessage(data=memcache.get(MEMCACHE_FEATUREDSPKR_KEY) or "",
+                             etag=etag)
 
 
 
@@ -530,6 +1025,9 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        # load stats before the seat count changes; missing ones are
+        # computed from it
+        stats = aggregates.loadStats(conf)
 
         # register
         if reg:
@@ -546,6 +1044,7 @@ class ConferenceApi(remote.Service):
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
             conf.seatsAvailable -= 1
+            stats.attendeeCount += 1
             retval = True
 
         # unregister
@@ -556,16 +1055,163 @@ class ConferenceApi(remote.Service):
                 # unregister user, add back one seat
                 prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
+                stats.attendeeCount -= 1
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
+        ndb.put_multi([prof, conf, stats])
+        versions.bump(versions.conferenceScope(conf.key))
         return BooleanMessage(data=retval)
 
 
+    @ndb.tasklet
+    def _takeSeatsAsync(self, conf_keys):
+        """Take one seat in each conference; must run in a transaction.
+
+        Returns a dict mapping each key to an error message, or None
+        when a seat was taken.
+        """
+        errors = {}
+        taken = []
+        confs = yield ndb.get_multi_async(conf_keys)
+        # load stats before the seat counts change
+        stats = yield [aggregates.loadStatsAsync(conf) for conf in confs if conf]
+        stats = dict((st.key.parent(), st) for st in stats)
+        for c_key, conf in zip(conf_keys, confs):
+            if not conf:
+                errors[c_key] = 'No conference found with key: %s' % c_key.urlsafe()
+            elif conf.seatsAvailable <= 0:
+                errors[c_key] = 'There are no seats available.'
+            else:
+                conf.seatsAvailable -= 1
+                stats[c_key].attendeeCount += 1
+                taken.append(conf)
+                errors[c_key] = None
+        if taken:
+            yield ndb.put_multi_async(
+                taken + [stats[conf.key] for conf in taken])
+            versions.bump(*[versions.conferenceScope(conf.key) for conf in taken])
+        raise ndb.Return(errors)
+
+
+    @ndb.tasklet
+    def _releaseSeatsAsync(self, conf_keys):
+        """Give back a seat taken by _takeSeatsAsync in each conference;
+        must run in a transaction."""
+        confs = yield ndb.get_multi_async(conf_keys)
+        confs = [conf for conf in confs if conf]
+        stats = yield [aggregates.loadStatsAsync(conf) for conf in confs]
+        for conf, st in zip(confs, stats):
+            conf.seatsAvailable += 1
+            st.attendeeCount -= 1
+        if confs:
+            yield ndb.put_multi_async(confs + stats)
+            versions.bump(*[versions.conferenceScope(conf.key) for conf in confs])
+
+
+    def _seatTransactions(self, conf_keys, tasklet):
+        """Run tasklet over conf_keys in parallel cross-group transactions
+        of at most XG_MAX_ENTITY_GROUPS entity groups, returning the
+        (chunk, future) pairs.
+
+        Conferences are grouped by their root (organizer profile) key, so
+        conferences of one organizer share a transaction instead of
+        contending for their entity group from parallel ones.
+        """
+        groups = collections.OrderedDict()
+        for c_key in conf_keys:
+            groups.setdefault(c_key.root(), []).append(c_key)
+        chunks = [[]]
+        roots = 0
+        for keys in groups.values():
+            if roots == XG_MAX_ENTITY_GROUPS:
+                chunks.append([])
+                roots = 0
+            chunks[-1].extend(keys)
+            roots += 1
+        return [(chunk, ndb.transaction_async(
+                    lambda chunk=chunk: tasklet(chunk), xg=True))
+                for chunk in chunks if chunk]
+
+
+    def _conferenceRegistrations(self, request):
+        """Register user for several conferences, returning RegistrationForms."""
+        if len(request.websafeConferenceKeys) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                "At most %d conferences may be registered for at once" % MAX_BATCH_SIZE)
+        prof = self._getProfileFromUser() # get user Profile
+
+        # check every key up front; only new registrations need a seat
+        errors = {}
+        wscks = {}
+        for wsck in request.websafeConferenceKeys:
+            if wsck in errors or wsck in prof.conferenceKeysToAttend:
+                errors.setdefault(wsck,
+                    "You have already registered for this conference")
+                continue
+            try:
+                c_key = ndb.Key(urlsafe=wsck)
+            except Exception:
+                c_key = None
+            if not c_key or c_key.kind() != 'Conference':
+                errors[wsck] = 'No conference found with key: %s' % wsck
+                continue
+            errors[wsck] = None
+            wscks[c_key] = wsck
+
+        # each cross-group transaction touches at most XG_MAX_ENTITY_GROUPS
+        # entity groups; they run in parallel and never touch the profile
+        futures = self._seatTransactions(wscks.keys(), self._takeSeatsAsync)
+        for chunk, future in futures:
+            try:
+                taken = future.get_result()
+            except (db.TransactionFailedError, db.Timeout):
+                taken = dict.fromkeys(chunk,
+                    'Registration failed, please try again.')
+            for c_key, error in taken.items():
+                errors[wscks[c_key]] = error
+
+        # register user for every conference that gave up a seat with a
+        # single profile transaction for the whole batch, re-reading the
+        # profile so registrations committed meanwhile are kept
+        taken = [wsck for wsck in wscks.values() if errors[wsck] is None]
+
+        @ndb.transactional()
+        def register():
+            current = prof.key.get()
+            added = [wsck for wsck in taken
+                     if wsck not in current.conferenceKeysToAttend]
+            current.conferenceKeysToAttend.extend(added)
+            current.put()
+            return added
+
+        released = []
+        if taken:
+            try:
+                added = register()
+            except (db.TransactionFailedError, db.Timeout):
+                added = []
+                for wsck in taken:
+                    errors[wsck] = 'Registration failed, please try again.'
+            # a concurrent registration already holds a seat for these
+            for wsck in set(taken) - set(added):
+                errors[wsck] = errors[wsck] or \
+                    "You have already registered for this conference"
+                released.append(ndb.Key(urlsafe=wsck))
+        for chunk, future in self._seatTransactions(released, self._releaseSeatsAsync):
+            try:
+                future.get_result()
+            except (db.TransactionFailedError, db.Timeout):
+                logging.exception('Could not give back seats of %s', chunk)
+
+        return RegistrationForms(items=[RegistrationForm(
+            websafeConferenceKey=wsck,
+            registered=errors[wsck] is None,
+            error=errors[wsck]) for wsck in request.websafeConferenceKeys])
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
@@ -573,7 +1219,8 @@ class ConferenceApi(remote.Service):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        # conferences that have ended may have been archived
+        conferences = [conf for conf in archive.getWithArchive(conf_keys) if conf]
 
 
         # get organizers
@@ -594,6 +1241,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @ratelimit.limited
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -602,11 +1250,21 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @ratelimit.limited
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
 
+    @endpoints.method(ConferenceKeysForm, RegistrationForms,
+            path='conferences/register',
+            http_method='POST', name='registerForConferences')
+    @ratelimit.limited
+    def registerForConferences(self, request):
+        """Register user for several conferences at once."""
+        return self._conferenceRegistrations(request)
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
@@ -639,13 +1297,59 @@ class ConferenceApi(remote.Service):
         return sf
 
 
-    def _createSessionObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    def _copySessionToSummary(self, session, fixed):
+        """Copy summary fields from (projected) Session to SessionSummaryForm;
+        fixed holds the values of fields the query filtered on by equality."""
+        ss = SessionSummaryForm()
+        for name in SESSION_SUMMARY_FIELDS:
+            if name in fixed:
+                setattr(ss, name, str(fixed[name]))
+            else:
+                setattr(ss, name, str(getattr(session, name)))
+        ss.urlsafeKey = session.key.urlsafe()
+        ss.check_initialized()
+        return ss
+
+
+    def _sessionForms(self, q, view, encoding=None, **fixed):
+        """Return SessionForms for a Session query in the requested view
+        and encoding.
+
+        The SUMMARY view is a projection query; fields filtered on by
+        equality cannot be projected and are copied from fixed instead.
+        """
+        if view == ListView.SUMMARY:
+            projection = [name for name in SESSION_SUMMARY_FIELDS if name not in fixed]
+            forms = SessionForms(
+                    summaries=[self._copySessionToSummary(session, fixed)
+                               for session in q.fetch(projection=projection)])
+        else:
+            forms = SessionForms(
+                    items=[self._copySessionToForm(session) for session in q.fetch()])
+        return compact.encodeForms(forms, encoding)
+
+
+    def _agendaForms(self, sessions, view, encoding=None):
+        """Return SessionForms for sessions of an agenda snapshot in the
+        requested view and encoding."""
+        if view == ListView.SUMMARY:
+            names = SESSION_SUMMARY_FIELDS + ('urlsafeKey',)
+            form = SessionSummaryForm
+        else:
+            names = agenda.AGENDA_FIELDS
+            form = SessionForm
+        # None is rendered as 'None', like _copySessionToForm does
+        items = [form(**dict((name, 'None' if session[name] is None else session[name])
+                             for name in names))
+                 for session in sessions]
+        if view == ListView.SUMMARY:
+            return compact.encodeForms(SessionForms(summaries=items), encoding)
+        return compact.encodeForms(SessionForms(items=items), encoding)
+
+
+    def _getOrganizedConference(self, wsck, user_id):
+        """Return Conference for websafe key, checking the user organizes it."""
         #Use the websafekey to locate the associated conference
-        wsck = request.websafeConferenceKey
         conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
@@ -654,37 +1358,59 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.UnauthorizedException(
                     'Only the organizer of this event may create a new session')
-        #At this point, all checks are complete. Proceed with gathering 
-        #data from SessionForm and put it in the Session DS
+        return conf
 
-        #Generate a Session Key. Session is a child of conference
-        #Use the conf key to form that relationship
-        c_key = conf.key
-        session_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        session_key = ndb.Key(Session, session_id, parent=c_key)
-        #Now, copy data from the Sessionform to the Session DS
+
+    def _sessionDataFromForm(self, request, conf):
+        """Validate SessionForm, returning dict of Session properties."""
         if not request.name:
             raise endpoints.BadRequestException("Session 'name' field required")
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        #Remove the websafekey, since the datastore does not need it
-        del data['websafeConferenceKey'] 
-        del data['urlsafeKey'] 
-        #Add the key to the collected data
-        data['key'] = session_key
+        #Only copy the fields a Session stores; the rest of the form
+        #(websafe keys, derived endTime, conflicts) is output only
+        data = {name: getattr(request, name) for name in SESSION_FORM_FIELDS}
         #Convert the date from string to Date object
-        if data['date']:
-            ddate = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-            data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+        try:
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+            #Convert the time from string to Time object
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(data['startTime'][:8], "%H:%M:%S").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                    "Session '%s' has an invalid date or start time" % request.name)
         #If the Session start date is before the conference start date raise an exception
         if (data['date'] < conf.startDate or data['date'] > conf.endDate):
                 raise endpoints.BadRequestException("Session can only exist between conference start and end dates")
-        #Convert the time from string to Time object
-        if data['startTime']:
-            stime = datetime.strptime(data['startTime'][:8], "%H:%M:%S").time()
-            #ddate = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-            data['startTime'] = stime
-        #Create the Session
-        session = Session(**data).put()
+        return data
+
+
+    def _createSessionObject(self, request):
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        conf = self._getOrganizedConference(request.websafeConferenceKey, user_id)
+        #At this point, all checks are complete. Proceed with gathering 
+        #data from SessionForm and put it in the Session DS
+        data = self._sessionDataFromForm(request, conf)
+
+        c_key = conf.key
+        session = Session(**data)
+
+        #Create the Session along with its search document and count it
+        #in the conference stats in one transaction. The Session is a
+        #child of the conference, its id taken from the conference stats
+        @ndb.transactional()
+        def write():
+            stats = aggregates.loadStats(conf)
+            session_id = aggregates.takeSessionIds(stats, 1)[0]
+            session.key = ndb.Key(Session, session_id, parent=c_key)
+            aggregates.addSessions(stats, [session])
+            ndb.put_multi([session, search.buildDocument(session), stats,
+                           agenda.addSessions(c_key, [session])])
+
+        write()
+        versions.bump(versions.sessionsScope(c_key))
         #TASK4
         #Check if the speaker already exists
         q = Session.query()
@@ -695,15 +1421,72 @@ class ConferenceApi(remote.Service):
                     url = '/tasks/set_featured_speaker'
                     )
 
-        return self._copySessionToForm(session.get())
+        return self._copySessionToForm(session)
+
+
+    def _createSessionObjects(self, request):
+        """Create a batch of Sessions for one conference, returning SessionForms."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        if not request.items:
+            raise endpoints.BadRequestException("At least one session required")
+        #A single commit writes the whole batch, so a failed batch can be
+        #retried without duplicating the sessions of an earlier commit
+        if len(request.items) > MAX_SESSIONS_PER_COMMIT:
+            raise endpoints.BadRequestException(
+                    "At most %d sessions may be created at once" % MAX_SESSIONS_PER_COMMIT)
+        conf = self._getOrganizedConference(request.websafeConferenceKey, user_id)
+        #Validate the whole agenda before anything is written
+        datas = [self._sessionDataFromForm(sf, conf) for sf in request.items]
+
+        c_key = conf.key
+        sessions = [Session(**data) for data in datas]
+
+        #Write the sessions, their search documents and the conference
+        #stats in one transaction, taking the ids of the sessions from the
+        #conference stats
+        @ndb.transactional()
+        def write():
+            stats = aggregates.loadStats(conf)
+            for sess, session_id in zip(sessions, aggregates.takeSessionIds(stats, len(sessions))):
+                sess.key = ndb.Key(Session, session_id, parent=c_key)
+            aggregates.addSessions(stats, sessions)
+            ndb.put_multi(sessions + [search.buildDocument(sess) for sess in sessions]
+                          + [stats, agenda.addSessions(c_key, sessions)])
+
+        write()
+        versions.bump(versions.sessionsScope(c_key))
+
+        #TASK4
+        #The speaker with the most sessions in the batch becomes the
+        #featured speaker; one task covers the whole batch
+        speakers = collections.Counter(
+                sess.speaker for sess in sessions if sess.speaker)
+        if speakers:
+            taskqueue.add( params={'featured_spkr':speakers.most_common(1)[0][0]},
+                    url = '/tasks/set_featured_speaker'
+                    )
+
+        return SessionForms(
+                items=[self._copySessionToForm(session) for session in sessions])
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm, path='session',
             http_method='POST', name='createSession')
+    @ratelimit.limited
     def createSession(self, request):
         """Create a new Session"""
         #TASK 1
         return self._createSessionObject(request)
 
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms, path='sessions',
+            http_method='POST', name='createSessions')
+    @ratelimit.limited
+    def createSessions(self, request):
+        """Create a batch of Sessions for a conference"""
+        return self._createSessionObjects(request)
+
     @endpoints.method(SESSION_GET_REQUEST, SessionForms, path='getConferenceSessions',
             http_method='POST', name='getConferenceSessions')
     def getConferenceSessions(self, request):
@@ -714,14 +1497,48 @@ class ConferenceApi(remote.Service):
         if not conf_key:
             raise endpoints.NotFoundException(
                     'No conference found with key: %s' % request.websafeConferenceKey)
-                
-        sessions = Session.query(ancestor=conf_key).fetch()
+        #Normalize the optional date and time filters to SessionForm strings
+        try:
+            date = request.date and datetime.strptime(
+                    request.date[:10], "%Y-%m-%d").date().isoformat()
+            start = request.startTime and str(datetime.strptime(
+                    request.startTime[:8], "%H:%M:%S").time())
+            end = request.endTime and str(datetime.strptime(
+                    request.endTime[:8], "%H:%M:%S").time())
+        except ValueError:
+            raise endpoints.BadRequestException(
+                    "date must be YYYY-MM-DD, startTime and endTime HH:MM:SS")
+        #Without pageSize or pageToken every session is returned at once
+        paged = bool(request.pageSize or request.pageToken)
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid pageToken")
+        #Compare versions before reading the agenda
+        etag = versions.etag([versions.sessionsScope(conf_key)],
+                variant='%s.%s.%s.%s.%s.%s' % (request.view.name, request.encoding.name,
+                                               date, start, end,
+                                               '%d+%d' % (offset, page_size) if paged else 'all'))
+        if self._ifNoneMatch(request) == etag:
+            return SessionForms(etag=etag, notModified=True)
+
+        #The agenda snapshot is one cache get; filter it in memory
+        matching = agenda.filterAgenda(agenda.loadAgenda(conf_key), date=date,
+                                       startTime=start, endTime=end)
         #Error Handling
-        if not sessions:
+        if not matching:
             raise endpoints.NotFoundException(
                     'No sessions found with conference key: %s' % request.websafeConferenceKey)
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessions])
+        next_token = None
+        if paged:
+            if len(matching) > offset + page_size:
+                next_token = str(offset + page_size)
+            matching = matching[offset:offset + page_size]
+        sessions = self._agendaForms(matching, request.view, request.encoding)
+        sessions.etag = etag
+        sessions.nextPageToken = next_token
+        return sessions
 
     @endpoints.method(SESSIONTYPE_GET_REQUEST, SessionForms, path='getConferenceSessionsByType',
             http_method='POST', name='getConferenceSessionsByType')
@@ -733,14 +1550,10 @@ class ConferenceApi(remote.Service):
         if not conf_key:
             raise endpoints.NotFoundException(
                     'No conference found with key: %s' % request.websafeConferenceKey)
-        sessions = Session.query(ancestor=conf_key)
-        #Error Handling
-        if not sessions:
-            raise endpoints.NotFoundException(
-                    'No sessions found with conference key: %s' % request.websafeConferenceKey)
-        sessionsType = sessions.filter(Session.typeOfSession == request.sessionType).fetch()
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessionsType])
+        #Filter the agenda snapshot in memory instead of querying
+        sessionsType = agenda.filterAgenda(agenda.loadAgenda(conf_key),
+                typeOfSession=request.sessionType)
+        return self._agendaForms(sessionsType, request.view, request.encoding)
 
 
     @endpoints.method(SESSIONSPKR_GET_REQUEST, SessionForms, path='getConferenceSessionsBySpeaker',
@@ -753,9 +1566,9 @@ class ConferenceApi(remote.Service):
         if not sessions:
             raise endpoints.NotFoundException(
                     'No sessions found. Please create sessions first.')
-        sessionsSpkr = sessions.filter(Session.speaker == request.speaker).fetch()
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessionsSpkr])
+        sessionsSpkr = sessions.filter(Session.speaker == request.speaker)
+        return self._sessionForms(sessionsSpkr, request.view, request.encoding,
+                speaker=request.speaker)
     
     @endpoints.method(SESSIONNAME_GET_REQUEST, SessionForms, path='getConferenceSessionsByName',
             http_method='POST', name='getConferenceSessionsByName')
@@ -767,9 +1580,9 @@ class ConferenceApi(remote.Service):
         if not sessions:
             raise endpoints.NotFoundException(
                     'No sessions found. Please create sessions first.')
-        sessionsName = sessions.filter(Session.name == request.name).fetch()
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessionsName])
+        sessionsName = sessions.filter(Session.name == request.name)
+        return self._sessionForms(sessionsName, request.view, request.encoding,
+                name=request.name)
 
     @endpoints.method(SESSIONSDATE, SessionForms, path='getConferenceSessionsBySDate',
             http_method='POST', name='getConferenceSessionsBySDate')
@@ -783,12 +1596,60 @@ class ConferenceApi(remote.Service):
         if not sessions:
             raise endpoints.NotFoundException(
                     'No sessions found. Please create sessions first.')
-        sessionsDate = sessions.filter(Session.date >= req_sdate).fetch()
+        sessionsDate = sessions.filter(Session.date >= req_sdate)
+        return self._sessionForms(sessionsDate, request.view, request.encoding)
+
+    @endpoints.method(SESSIONWINDOW_GET_REQUEST, SessionForms, path='getSessionsInTimeWindow',
+            http_method='GET', name='getSessionsInTimeWindow')
+    def getSessionsInTimeWindow(self, request):
+        """Return sessions on a date that overlap a start/end time window,
+        optionally within one conference"""
+        try:
+            req_date = datetime.strptime(request.date[:10], "%Y-%m-%d").date()
+            window_start = datetime.strptime(request.startTime[:8], "%H:%M:%S").time()
+            window_end = datetime.strptime(request.endTime[:8], "%H:%M:%S").time()
+        except (TypeError, ValueError):
+            raise endpoints.BadRequestException(
+                    "date (YYYY-MM-DD), startTime and endTime (HH:MM:SS) required")
+        if window_end <= window_start:
+            raise endpoints.BadRequestException("endTime must be after startTime")
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        #Read only the times of the sessions in the window's hour buckets,
+        #one projection query per bucket in parallel, check the exact
+        #overlap in memory and get only the overlapping sessions
+        scans = [self._scanBucketAsync(bucket, ancestor)
+                 for bucket in timeindex.hourBuckets(req_date, window_start, window_end)]
+        keys = set()
+        for scan in scans:
+            keys.update(sess.key for sess in scan.get_result()
+                        if timeindex.overlaps(sess.startTime, sess.endTime,
+                                              window_start, window_end))
+        sessions = [sess for sess in ndb.get_multi(list(keys)) if sess]
+        sessions.sort(key=lambda sess: sess.startTime)
         return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessionsDate])
+                items=[self._copySessionToForm(session) for session in sessions])
+
+    @ndb.tasklet
+    def _scanBucketAsync(self, bucket, ancestor):
+        """Return the (projected) start and end times of every session in
+        an hour bucket, a page at a time."""
+        query = Session.query(Session.timeBuckets == bucket, ancestor=ancestor)
+        found = []
+        cursor = None
+        more = True
+        while more:
+            page, cursor, more = yield query.fetch_page_async(
+                BUCKET_PAGE_SIZE, start_cursor=cursor,
+                projection=(Session.startTime, Session.endTime))
+            found.extend(page)
+        raise ndb.Return(found)
 
     @endpoints.method(WISHLIST_POST_REQUEST, SessionForm, path='sessionWishlist',
             http_method='POST', name='addSessionToWishlist')
+    @ratelimit.limited
     def addSessionToWishlist(self, request):
         #TASK 2
         """Adds sessions to a user wishlist & returns the sessions added"""
@@ -804,17 +1665,22 @@ class ConferenceApi(remote.Service):
         q = SessionWishlist.query()
         if (q.filter(SessionWishlist.sessionKey == request.SessionKey).count() > 0):
                 raise endpoints.BadRequestException("SessionKey is already in %s's wishlist" % user)
+        session = archive.getWithArchive([ndb.Key(urlsafe=request.SessionKey)])[0]
+        if not session:
+            raise endpoints.NotFoundException(
+                    'No session found with key: %s' % request.SessionKey)
         #Generate a Wishlist key to store the user wishlist. The wishlist will be created as
-        #a child of Profile
+        #a child of Profile, named after the session so no id is allocated
         p_key = ndb.Key(Profile, user_id)
-        w_id = SessionWishlist.allocate_ids(size=1, parent=p_key)[0]
-        w_key = ndb.Key(SessionWishlist, w_id, parent=p_key)
-        #Add the wishlist to the DS
+        w_key = ndb.Key(SessionWishlist, request.SessionKey, parent=p_key)
+        #Add the wishlist to the DS along with the session's slot in the
+        #user's schedule, collecting the wishlisted sessions it overlaps
         wishlist = SessionWishlist( key = w_key, sessionKey = request.SessionKey)
-        wl_key = wishlist.put()
+        conflicts = schedule.addToWishlist(wishlist, session)
         #Return the session associated with the created entry
-        session = ndb.Key(urlsafe=request.SessionKey).get()
-        return self._copySessionToForm(session)
+        sf = self._copySessionToForm(session)
+        sf.conflicts = conflicts
+        return sf
 
     @endpoints.method(message_types.VoidMessage, SessionForms, path='getsessionsWishlist',
             http_method='GET', name='getSessionsInWishlist')
@@ -829,13 +1695,30 @@ class ConferenceApi(remote.Service):
         #Query the list of wishlist sessions based on ancestor key p_key
         wishlist = SessionWishlist.query(ancestor=p_key).fetch()
         #generate a list of sessions using the sessionKey stored in the wishlist
-        sessions = []
-        for wish_session in wishlist:
-            sessions.append(ndb.Key(urlsafe=wish_session.sessionKey).get())
+        #sessions of ended conferences may have been archived
+        sessions = archive.getWithArchive(
+                [ndb.Key(urlsafe=wish_session.sessionKey) for wish_session in wishlist])
+        sessions = [session for session in sessions if session]
 
         return SessionForms(
                 items=[self._copySessionToForm(session) for session in sessions]
                 )
+
+    @endpoints.method(message_types.VoidMessage, SessionForms, path='wishlistItinerary',
+            http_method='GET', name='getWishlistItinerary')
+    def getWishlistItinerary(self, request):
+        """Get the largest set of user wishlist sessions that do not overlap"""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization Required')
+        p_key = ndb.Key(Profile, getUserId(user))
+        #The schedule keeps the wishlist's intervals, so one get is enough
+        #to pick the sessions; only those are read
+        keys = schedule.itinerary(schedule.loadSchedule(p_key))
+        sessions = archive.getWithArchive([ndb.Key(urlsafe=key) for key in keys])
+        return SessionForms(
+                items=[self._copySessionToForm(session) for session in sessions if session]
+                )
         
     @endpoints.method(message_types.VoidMessage, SessionForms,
             path='sessionsfilter',
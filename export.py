@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Conference Central bulk export of Conference, Session, Profile and
+SessionWishlist entities, and of the ArchivedConference and
+ArchivedSession entities ended conferences are moved to (see
+archive.py), to newline-delimited JSON or CSV.
+
+An ExportJob walks each kind with a query cursor. Every task queue worker
+writes one batch as an ExportChunk, checkpoints the cursor on the job in
+the same transaction and chains the next worker, so memory use is bounded
+by EXPORT_BATCH_SIZE and an interrupted export can be resumed from the
+last cursor.
+
+"""
+
+import csv
+import json
+from cStringIO import StringIO
+from datetime import date
+from datetime import datetime
+from datetime import time
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import ExportChunk
+from models import ExportJob
+
+EXPORT_KINDS = ('Conference', 'Session', 'Profile', 'SessionWishlist',
+                'ArchivedConference', 'ArchivedSession')
+EXPORT_FORMATS = ('json', 'csv')
+EXPORT_BATCH_SIZE = 200
+EXPORT_TASK_URL = '/tasks/export'
+DOWNLOAD_BATCH_SIZE = 10
+
+
+def _encodeValue(value):
+    """Return a JSON-serializable version of a property value."""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, list):
+        return [_encodeValue(v) for v in value]
+    return value
+
+
+def _columns(kind):
+    """Return the CSV columns for a kind: the key, then sorted properties."""
+    model = ndb.Model._lookup_model(kind)
+    return ['key'] + sorted(model._properties)
+
+
+def entityToDict(entity):
+    """Return a flat dict of an entity's key and properties."""
+    row = {'key': entity.key.urlsafe()}
+    for name, value in entity.to_dict().items():
+        row[name] = _encodeValue(value)
+    return row
+
+
+def _serialize(kind, entities, fmt, header):
+    """Serialize a batch of entities to newline-delimited JSON or CSV."""
+    out = StringIO()
+    if fmt == 'json':
+        for entity in entities:
+            row = entityToDict(entity)
+            row['kind'] = kind
+            out.write(json.dumps(row, sort_keys=True, separators=(',', ':')))
+            out.write('\n')
+    else:
+        columns = _columns(kind)
+        writer = csv.writer(out)
+        if header:
+            writer.writerow(columns)
+        for entity in entities:
+            row = entityToDict(entity)
+            values = []
+            for column in columns:
+                value = row.get(column)
+                # repeated properties are stored as a JSON list in one cell
+                if isinstance(value, list):
+                    value = json.dumps(value, separators=(',', ':'))
+                elif isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                values.append('' if value is None else value)
+            writer.writerow(values)
+    return out.getvalue()
+
+
+def chunkId(kind, seq):
+    """Return the ExportChunk id of the seq'th chunk of a kind."""
+    return '%s-%06d' % (kind, seq)
+
+
+def _enqueue(job_key, transactional=False):
+    """Chain the export worker for a job."""
+    taskqueue.add(params={'job': job_key.id()}, url=EXPORT_TASK_URL,
+                  transactional=transactional)
+
+
+def startExport(fmt='json', kinds=EXPORT_KINDS, since=None):
+    """Create an ExportJob and start its first worker, returning the job.
+
+    When since is given only entities modified at or after that datetime
+    are exported.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format: %s' % fmt)
+    for kind in kinds:
+        if kind not in EXPORT_KINDS:
+            raise ValueError('Unknown export kind: %s' % kind)
+    job = ExportJob(format=fmt, kinds=list(kinds), since=since, chunkCounts={})
+    job.put()
+    _enqueue(job.key)
+    return job
+
+
+def resumeExport(job_id):
+    """Restart the worker chain of an unfinished job from its last cursor."""
+    job = ExportJob.get_by_id(job_id)
+    if job and job.state == 'running':
+        _enqueue(job.key)
+    return job
+
+
+def _query(job, kind):
+    """Return the query walked for a kind of a job."""
+    model = ndb.Model._lookup_model(kind)
+    if job.since:
+        # incremental export; only rewritten entities carry lastModified
+        return model.query(model.lastModified >= job.since).order(
+            model.lastModified, model.key)
+    return model.query().order(model.key)
+
+
+def runExportBatch(job_id):
+    """Export one batch of a job and chain the next worker."""
+    job = ExportJob.get_by_id(job_id)
+    if not job or job.state != 'running':
+        return
+    kind = job.kinds[job.kindIndex]
+    start_cursor = job.cursor
+    entities, cursor, more = _query(job, kind).fetch_page(
+        EXPORT_BATCH_SIZE,
+        start_cursor=Cursor(urlsafe=start_cursor) if start_cursor else None)
+
+    seq = job.chunkCounts.get(kind, 0)
+    chunk = None
+    if entities:
+        chunk = ExportChunk(
+            key=ndb.Key(ExportChunk, chunkId(kind, seq), parent=job.key),
+            kind=kind, count=len(entities),
+            data=_serialize(kind, entities, job.format, header=seq == 0))
+
+    @ndb.transactional()
+    def checkpoint():
+        current = job.key.get()
+        # a retried or duplicate worker already handled this batch
+        if current.state != 'running' or current.cursor != start_cursor \
+                or current.kindIndex != job.kindIndex:
+            return
+        if chunk:
+            current.chunkCounts[kind] = seq + 1
+            current.entityCount += len(entities)
+        if more and cursor:
+            current.cursor = cursor.urlsafe()
+        else:
+            current.kindIndex += 1
+            current.cursor = None
+        if current.kindIndex >= len(current.kinds):
+            current.state = 'done'
+        else:
+            _enqueue(current.key, transactional=True)
+        ndb.put_multi([current, chunk] if chunk else [current])
+
+    checkpoint()
+
+
+def iterExport(job, kind):
+    """Yield the exported text of one kind of a job, chunk by chunk."""
+    count = job.chunkCounts.get(kind, 0)
+    for start in range(0, count, DOWNLOAD_BATCH_SIZE):
+        keys = [ndb.Key(ExportChunk, chunkId(kind, seq), parent=job.key)
+                for seq in range(start, min(start + DOWNLOAD_BATCH_SIZE, count))]
+        for chunk in ndb.get_multi(keys):
+            if chunk:
+                yield chunk.data
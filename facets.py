@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Conference Central facet counts of the conference browser.
+
+For each field queryConferences filters on (city, topics, month and
+maxAttendees) the number of current conferences having each value is
+kept, over all conferences and within each single equality filter (for
+instance the topic counts of the conferences in one city), so the
+browser can show a count next to every filter choice.
+
+The counts are split over NUM_SHARDS FacetShard entities. A conference
+write adds its change to one shard picked at random, in the transaction
+writing the conference, so concurrent writes seldom contend. Reads sum
+all shards with a single get_multi and cache the total in memcache,
+tagged with the facets version token (see versions.py); a cached copy
+tagged with an older token is ignored.
+
+Archived conferences are subtracted once archived. rebuildFacets()
+replaces the counts with a count of the stored conferences, to include
+those created before the counts existed, spreading them over the shards
+by a hash of their scope, field and value so no shard holds them all.
+
+"""
+
+import random
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import FacetShard
+import archive
+import versions
+
+NUM_SHARDS = 20
+SHARD_ID_TPL = 'facets:%d'
+MEMCACHE_FACETS_KEY = 'FACETS'
+REBUILD_TASK_URL = '/tasks/rebuild_facets'
+REBUILD_BATCH_SIZE = 500
+
+FACET_FIELDS = ('city', 'topics', 'month', 'maxAttendees')
+# pseudo field counting the conferences of a scope
+TOTAL_FIELD = '*'
+ALL_SCOPE = ''
+
+
+def shardKeys():
+    """Return the keys of all FacetShard entities."""
+    return [ndb.Key(FacetShard, SHARD_ID_TPL % i) for i in range(NUM_SHARDS)]
+
+
+def facetValues(conf):
+    """Return the sorted (field, value) pairs of a conference, values as
+    the strings a filter holds."""
+    pairs = set()
+    for field in FACET_FIELDS:
+        values = getattr(conf, field)
+        for value in values if isinstance(values, list) else [values]:
+            if value not in (None, ''):
+                pairs.add((field, unicode(value)))
+    return sorted(pairs)
+
+
+def scope(field, value):
+    """Return the scope of the counts within the filter field = value."""
+    return '%s=%s' % (field, value)
+
+
+def _addCounts(counts, pairs, delta):
+    """Add delta to the counts of the values of one conference, overall
+    and within the filter of each of its values."""
+    pairs = [(TOTAL_FIELD, '')] + list(pairs)
+    for scope_ in [ALL_SCOPE] + [scope(field, value) for field, value in pairs[1:]]:
+        fields = counts.setdefault(scope_, {})
+        for field, value in pairs:
+            values = fields.setdefault(field, {})
+            count = values.get(value, 0) + delta
+            if count:
+                values[value] = count
+            else:
+                del values[value]
+            if not values:
+                del fields[field]
+        if not fields:
+            del counts[scope_]
+
+
+def _merge(total, counts):
+    for scope_, fields in counts.items():
+        for field, values in fields.items():
+            merged = total.setdefault(scope_, {}).setdefault(field, {})
+            for value, count in values.items():
+                merged[value] = merged.get(value, 0) + count
+
+
+def _split(counts):
+    """Return counts split into NUM_SHARDS parts, each count going to the
+    part picked by a hash of its scope, field and value."""
+    parts = [{} for _ in range(NUM_SHARDS)]
+    for scope_, fields in counts.items():
+        for field, values in fields.items():
+            for value, count in values.items():
+                name = u'%s\n%s\n%s' % (scope_, field, value)
+                part = parts[zlib.crc32(name.encode('utf-8')) % NUM_SHARDS]
+                part.setdefault(scope_, {}).setdefault(field, {})[value] = count
+    return parts
+
+
+def changedShard(removed, added):
+    """Return a random shard with the facet values removed subtracted and
+    added added (lists of facetValues() results), or None if they cancel
+    out.
+
+    Call it in the transaction writing the conferences, cross-group if
+    they have a parent, and put the result there too.
+    """
+    if sorted(removed) == sorted(added):
+        return None
+    key = random.choice(shardKeys())
+    shard = key.get() or FacetShard(key=key, counts={})
+    for pairs in removed:
+        _addCounts(shard.counts, pairs, -1)
+    for pairs in added:
+        _addCounts(shard.counts, pairs, 1)
+    versions.bump(versions.FACETS_SCOPE)
+    return shard
+
+
+@ndb.transactional()
+def storeChange(removed, added):
+    """Like changedShard(), writing the shard in its own transaction."""
+    shard = changedShard(removed, added)
+    if shard:
+        shard.put()
+
+
+def loadFacets():
+    """Return the facet counts as {scope: {field: {value: count}}}."""
+    version_key = versions.MEMCACHE_VERSION_TPL % versions.FACETS_SCOPE
+    cached = memcache.get_multi([version_key, MEMCACHE_FACETS_KEY])
+    token = cached.get(version_key)
+    entry = cached.get(MEMCACHE_FACETS_KEY)
+    if token and entry and entry[0] == token:
+        return entry[1]
+    # the token is read before the shards, so a write racing with this
+    # read can only leave the cached copy tagged with an older token
+    token = token or versions.addToken(versions.FACETS_SCOPE)
+    counts = {}
+    for shard in ndb.get_multi(shardKeys()):
+        if shard:
+            _merge(counts, shard.counts)
+    memcache.set(MEMCACHE_FACETS_KEY, (token, counts))
+    return counts
+
+
+def facetCounts(counts, field=None, value=None):
+    """Return the number of conferences within the filter field = value,
+    or of all conferences, and the sorted (field, value, count) triples
+    of the values they have."""
+    fields = counts.get(scope(field, value) if field else ALL_SCOPE, {})
+    total = sum(fields.get(TOTAL_FIELD, {}).values())
+    rows = sorted((field_, value_, count)
+                  for field_, values in fields.items() if field_ != TOTAL_FIELD
+                  for value_, count in values.items() if count > 0)
+    return total, rows
+
+
+def rebuildFacets():
+    """Replace the facet counts with a count of the current conferences.
+
+    Conference writes committed while the conferences are scanned may be
+    lost, so run it when few are expected.
+    """
+    counts = {}
+    for conf in Conference.query().iter(batch_size=REBUILD_BATCH_SIZE):
+        _addCounts(counts, facetValues(conf), 1)
+
+    @ndb.transactional(xg=True)
+    def store():
+        shards = [FacetShard(key=key, counts=part)
+                  for key, part in zip(shardKeys(), _split(counts))]
+        ndb.put_multi(shards)
+        versions.bump(versions.FACETS_SCOPE)
+
+    store()
+    return sum(counts.get(ALL_SCOPE, {}).get(TOTAL_FIELD, {}).values())
+
+
+# archived conferences leave the counts of current conferences
+archive.ON_ARCHIVE.append(
+    lambda conf: storeChange([facetValues(conf)], []))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""idalloc.py
+
+Conference Central deterministic id allocation.
+
+Reserving the id of each new entity with allocate_ids costs a datastore
+round trip before its put. Child entities instead take their ids from an
+IdCounter stored under their parent, per kind, that the transaction
+creating them reads and writes along with them: a new conference only
+adds the counter of its organizer Profile to the transaction that writes
+it.
+
+A counter created for a parent that already has children starts above
+their ids, archived children included, so ids are never reused. Session
+ids are taken the same way from the ConferenceStats that their
+transaction writes anyway (see aggregates.takeSessionIds).
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import IdCounter
+import archive
+
+
+def counterKey(model, parent):
+    """Return the key of the IdCounter of model children of parent."""
+    return ndb.Key(IdCounter, model._get_kind(), parent=parent)
+
+
+def loadCounter(model, parent):
+    """Return the IdCounter of model children of parent, starting a new
+    one above their existing ids."""
+    counter = counterKey(model, parent).get()
+    if counter:
+        return counter
+    kind = model._get_kind()
+    ids = [0]
+    for name in (kind, archive.ARCHIVED_KINDS.get(kind)):
+        if name:
+            ids.extend(key.id() for key in
+                       ndb.Query(kind=name, ancestor=parent).fetch(keys_only=True)
+                       if key.parent() == parent and isinstance(key.id(), (int, long)))
+    return IdCounter(key=counterKey(model, parent), nextId=max(ids) + 1)
+
+
+def takeIds(counter, count=1):
+    """Return count unused ids of counter; call it in the transaction that
+    writes the counter and the new entities."""
+    first = counter.nextId
+    counter.nextId += count
+    return range(first, first + count)
+
+
+@ndb.transactional()
+def reserveIds(model, parent, count):
+    """Return count unused ids for model children of parent, committing the
+    counter in a transaction of its own."""
+    counter = loadCounter(model, parent)
+    ids = takeIds(counter, count)
+    counter.put()
+    return ids
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""index_advisor.py
+
+Derive the minimal set of composite indexes needed by queryConferences
+from the FIELDS and OPERATORS tables in conference.py.
+
+ConferenceApi._queryConferences answers equality filters by merge-joining
+keys-only single-property scans, which only need built-in indexes. The
+only sorted query is the one on the inequality field, so one (field, name)
+index per filterable field is enough, however many filters are combined.
+
+Run with the App Engine SDK on the PYTHONPATH:
+
+    python index_advisor.py                 # report and print the indexes
+    python index_advisor.py --write index.yaml
+
+--write replaces the indexes between the index_advisor markers in
+index.yaml, adding the markers above the AUTOGENERATED line if missing.
+Indexes dropped from index.yaml are only deleted from production by
+`appcfg.py vacuum_indexes`.
+
+"""
+
+import itertools
+import optparse
+import sys
+
+from conference import FIELDS
+from conference import OPERATORS
+
+ORDER = 'name'
+BEGIN_MARKER = '# BEGIN index_advisor'
+END_MARKER = '# END index_advisor'
+AUTOGENERATED_MARKER = '# AUTOGENERATED'
+
+# composite indexes of queries other than the queryConferences filters,
+# as (kind, ancestor, properties)
+STATIC_INDEXES = [
+    # SUMMARY view projection queries
+    ('Conference', False,
+     ('name', 'city', 'endDate', 'seatsAvailable', 'startDate')),
+    ('Conference', True,
+     ('city', 'endDate', 'name', 'seatsAvailable', 'startDate')),
+    ('ArchivedConference', True,
+     ('city', 'endDate', 'name', 'seatsAvailable', 'startDate')),
+    # getSessionsInTimeWindow bucket scans
+    ('Session', False, ('timeBuckets', 'endTime', 'startTime')),
+    ('Session', True, ('timeBuckets', 'endTime', 'startTime')),
+    ('Session', False,
+     ('speaker', 'date', 'name', 'startTime', 'typeOfSession')),
+    ('Session', False,
+     ('name', 'date', 'speaker', 'startTime', 'typeOfSession')),
+    ('Session', False,
+     ('date', 'name', 'speaker', 'startTime', 'typeOfSession')),
+]
+
+
+def _hasInequality():
+    return any(op != '=' for op in OPERATORS.values())
+
+
+def mergeJoinIndexes():
+    """Return the indexes queryConferences needs with merge-joined scans."""
+    indexes = []
+    if _hasInequality():
+        # includePast runs the same queries over ArchivedConference
+        for kind in ('Conference', 'ArchivedConference'):
+            for field in sorted(FIELDS.values()):
+                indexes.append((kind, False, (field, ORDER)))
+    return indexes + STATIC_INDEXES
+
+
+def compositeIndexes():
+    """Return the indexes a single sorted query per filter combination
+    would need, for comparison."""
+    fields = sorted(FIELDS.values())
+    indexes = set()
+    for n in range(1, len(fields) + 1):
+        for equalities in itertools.combinations(fields, n):
+            indexes.add(equalities + (ORDER,))
+    if _hasInequality():
+        for inequality in fields:
+            others = [field for field in fields if field != inequality]
+            for n in range(len(others) + 1):
+                for equalities in itertools.combinations(others, n):
+                    indexes.add(equalities + (inequality, ORDER))
+    return [('Conference', False, props) for props in sorted(indexes)]
+
+
+def toYaml(indexes):
+    """Return index.yaml entries for indexes."""
+    lines = []
+    for kind, ancestor, props in indexes:
+        lines.append('- kind: %s' % kind)
+        if ancestor:
+            lines.append('  ancestor: yes')
+        lines.append('  properties:')
+        for prop in props:
+            if prop.startswith('-'):
+                lines.append('  - name: %s' % prop[1:])
+                lines.append('    direction: desc')
+            else:
+                lines.append('  - name: %s' % prop)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def writeIndexYaml(path, indexes):
+    """Replace the index_advisor section of an index.yaml file."""
+    with open(path) as f:
+        text = f.read()
+    section = '%s\n\n%s\n%s\n' % (BEGIN_MARKER, toYaml(indexes), END_MARKER)
+    if BEGIN_MARKER in text and END_MARKER in text:
+        start = text.index(BEGIN_MARKER)
+        end = text.index(END_MARKER) + len(END_MARKER) + 1
+        text = text[:start] + section + text[end:]
+    elif AUTOGENERATED_MARKER in text:
+        start = text.index(AUTOGENERATED_MARKER)
+        text = text[:start] + section + '\n' + text[start:]
+    else:
+        text = text.rstrip('\n') + '\n\n' + section
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [--write index.yaml]')
+    parser.add_option('--write', metavar='FILE',
+                      help='update the index_advisor section of FILE')
+    options, _ = parser.parse_args(argv)
+
+    indexes = mergeJoinIndexes()
+    sys.stderr.write('queryConferences needs %d composite indexes '
+                     '(%d with one sorted query per filter combination)\n'
+                     % (len(indexes) - len(STATIC_INDEXES),
+                        len(compositeIndexes())))
+    if options.write:
+        writeIndexYaml(options.write, indexes)
+    else:
+        sys.stdout.write(toYaml(indexes))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
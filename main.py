@@ -12,10 +12,22 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+from datetime import datetime
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+import archive
+import export
+import facets
+import migrations
+import topics
+from models import ExportJob
+from models import MigrationProgress
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -23,6 +35,18 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
+class ArchiveConferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Archive conferences past their end date (cron)."""
+        archive.archiveEndedConferences()
+        self.response.set_status(204)
+
+    def post(self):
+        """Archive the next batch of ended conferences (task)."""
+        archive.archiveEndedConferences()
+        self.response.set_status(204)
+
+
 class SetFeaturedSpeaker(webapp2.RequestHandler):
     def post(self):
         """Set Featured Speaker in Memcache."""
@@ -33,6 +57,28 @@ class SetFeaturedSpeaker(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class IndexTopicsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Reconcile the topic index with changed conferences."""
+        topics.updateIndex(self.request.get_all('conference'),
+                           self.request.get_all('topic'))
+        self.response.set_status(204)
+
+
+class RebuildFacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Recount the facet counts of the conference browser."""
+        facets.rebuildFacets()
+        self.response.set_status(204)
+
+
+class FacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Queue a recount of the facet counts."""
+        taskqueue.add(url=facets.REBUILD_TASK_URL)
+        self.response.set_status(202)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
@@ -47,8 +93,115 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class ExportWorkerHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export one batch of a bulk export job."""
+        export.runExportBatch(int(self.request.get('job')))
+        self.response.set_status(204)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def _writeJob(self, job):
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'job': job.key.id(),
+            'format': job.format,
+            'kinds': job.kinds,
+            'state': job.state,
+            'entityCount': job.entityCount,
+            'chunkCounts': job.chunkCounts,
+        }))
+
+    def get(self):
+        """Return the status of an export job."""
+        job = ExportJob.get_by_id(int(self.request.get('job')))
+        if not job:
+            self.abort(404)
+        self._writeJob(job)
+
+    def post(self):
+        """Start an export; since (YYYY-MM-DDTHH:MM:SS) makes it incremental."""
+        since = self.request.get('since')
+        kinds = self.request.get('kinds')
+        try:
+            job = export.startExport(
+                fmt=self.request.get('format', 'json'),
+                kinds=kinds.split(',') if kinds else export.EXPORT_KINDS,
+                since=datetime.strptime(since, '%Y-%m-%dT%H:%M:%S') if since else None)
+        except ValueError as e:
+            self.abort(400, detail=str(e))
+        self._writeJob(job)
+
+
+class ExportResumeHandler(webapp2.RequestHandler):
+    def post(self):
+        """Resume an interrupted export from its last cursor."""
+        if not export.resumeExport(int(self.request.get('job'))):
+            self.abort(404)
+        self.response.set_status(204)
+
+
+class ExportDownloadHandler(webapp2.RequestHandler):
+    def get(self):
+        """Stream the exported file of one kind of a finished export."""
+        job = ExportJob.get_by_id(int(self.request.get('job')))
+        kind = self.request.get('kind')
+        if not job or kind not in job.kinds:
+            self.abort(404)
+        if job.format == 'json':
+            self.response.headers['Content-Type'] = 'application/x-ndjson'
+        else:
+            self.response.headers['Content-Type'] = 'text/csv'
+        self.response.headers['Content-Disposition'] = (
+            'attachment; filename=%s-%s.%s' % (kind, job.key.id(), job.format))
+        for data in export.iterExport(job, kind):
+            self.response.write(data)
+
+
+class MigrationWorkerHandler(webapp2.RequestHandler):
+    def post(self):
+        """Migrate one batch of a backfill."""
+        migrations.runMigrationBatch(self.request.get('name'))
+        self.response.set_status(204)
+
+
+class MigrationHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress of every registered migration."""
+        names = sorted(migrations.MIGRATIONS)
+        progresses = ndb.get_multi([ndb.Key(MigrationProgress, name) for name in names])
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps([{
+            'name': name,
+            'state': progress.state if progress else 'not started',
+            'processed': progress.processed if progress else 0,
+            'updated': progress.updated if progress else 0,
+            'batches': progress.batches if progress else 0,
+        } for name, progress in zip(names, progresses)]))
+
+    def post(self):
+        """Start or resume a migration; restart=1 runs it again from the start."""
+        try:
+            migrations.startMigration(self.request.get('name'),
+                restart=self.request.get('restart') == '1')
+        except ValueError as e:
+            self.abort(400, detail=str(e))
+        self.response.set_status(204)
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/archive_conferences', ArchiveConferencesHandler),
+    ('/tasks/archive_conferences', ArchiveConferencesHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeaker),
+    ('/tasks/index_topics', IndexTopicsHandler),
+    ('/tasks/rebuild_facets', RebuildFacetsHandler),
+    ('/admin/facets', FacetsHandler),
+    ('/tasks/export', ExportWorkerHandler),
+    ('/admin/export', ExportHandler),
+    ('/admin/export/resume', ExportResumeHandler),
+    ('/admin/export/download', ExportDownloadHandler),
+    ('/tasks/migrate', MigrationWorkerHandler),
+    ('/admin/migrate', MigrationHandler),
 ], debug=True)
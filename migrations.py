@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+"""migrations.py
+
+Conference Central resumable backfills driven by the task queue.
+
+A Migration walks one kind with a query cursor, rewrites each batch with
+put_multi and checkpoints the cursor in a MigrationProgress entity before
+chaining the next worker. Workers are throttled to the migration's target
+write rate, and migrate() must be idempotent so a migration can safely be
+re-run from the start.
+
+"""
+
+import logging
+import time
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import MigrationProgress
+import agenda
+import search
+import topics
+
+MIGRATION_TASK_URL = '/tasks/migrate'
+
+MIGRATIONS = {}
+
+
+def register(cls):
+    """Class decorator adding a Migration to the MIGRATIONS registry."""
+    MIGRATIONS[cls.name] = cls()
+    return cls
+
+
+class Migration(object):
+    """Migration -- backfill of one kind; subclasses implement migrate()"""
+    name = None
+    kind = None
+    batch_size = 100
+    writes_per_second = 50
+
+    def query(self):
+        """Return the query walked by the migration, in key order."""
+        model = ndb.Model._lookup_model(self.kind)
+        return model.query().order(model.key)
+
+    def migrate(self, entity):
+        """Update entity in place, returning True if it must be written."""
+        raise NotImplementedError
+
+    def entitiesToWrite(self, entity):
+        """Return the entities to write for entity; override to backfill
+        entities derived from it instead of the entity itself."""
+        return [entity] if self.migrate(entity) else []
+
+    def finishBatch(self, entities):
+        """Called with each batch after its writes; override to hand the
+        batch to other workers."""
+
+
+class TouchMigration(Migration):
+    """TouchMigration -- rewrite every entity of a kind unchanged
+
+    Rewriting populates auto_now and default properties and the index rows
+    of properties added after the entity was written.
+    """
+
+    def migrate(self, entity):
+        return True
+
+
+@register
+class TouchConferences(TouchMigration):
+    name = 'touch-conferences'
+    kind = 'Conference'
+
+
+@register
+class TouchSessions(TouchMigration):
+    name = 'touch-sessions'
+    kind = 'Session'
+
+
+@register
+class TouchProfiles(TouchMigration):
+    name = 'touch-profiles'
+    kind = 'Profile'
+
+
+@register
+class TouchWishlists(TouchMigration):
+    name = 'touch-wishlists'
+    kind = 'SessionWishlist'
+
+
+class SearchIndexMigration(Migration):
+    """SearchIndexMigration -- (re)build the SearchDocument of every entity"""
+
+    def entitiesToWrite(self, entity):
+        return [search.buildDocument(entity)]
+
+
+@register
+class SearchIndexConferences(SearchIndexMigration):
+    name = 'search-index-conferences'
+    kind = 'Conference'
+
+
+@register
+class SearchIndexSessions(SearchIndexMigration):
+    name = 'search-index-sessions'
+    kind = 'Session'
+
+
+@register
+class TopicIndexConferences(Migration):
+    """TopicIndexConferences -- (re)index the topics of every Conference"""
+    name = 'topic-index-conferences'
+    kind = 'Conference'
+
+    def entitiesToWrite(self, entity):
+        return []
+
+    def finishBatch(self, entities):
+        topics.reindexConferences([conf.key for conf in entities])
+
+
+@register
+class AgendaSnapshots(Migration):
+    """AgendaSnapshots -- rebuild the agenda snapshot of every Conference"""
+    name = 'agenda-snapshots'
+    kind = 'Conference'
+
+    def entitiesToWrite(self, entity):
+        return []
+
+    def finishBatch(self, entities):
+        for conf in entities:
+            agenda.storeSnapshot(conf.key)
+
+
+def _enqueue(name, countdown=0, transactional=False):
+    """Chain the migration worker."""
+    taskqueue.add(params={'name': name}, url=MIGRATION_TASK_URL,
+                  countdown=countdown, transactional=transactional)
+
+
+def startMigration(name, restart=False):
+    """Start or resume a migration, returning its MigrationProgress.
+
+    A running migration continues from its last cursor; a finished one is
+    only run again from the start when restart is set.
+    """
+    if name not in MIGRATIONS:
+        raise ValueError('Unknown migration: %s' % name)
+
+    @ndb.transactional()
+    def start():
+        progress = MigrationProgress.get_by_id(name)
+        if progress and progress.state == 'done' and not restart:
+            return progress
+        if not progress or restart:
+            progress = MigrationProgress(id=name, started=datetime.now())
+        progress.state = 'running'
+        progress.put()
+        _enqueue(name, transactional=True)
+        return progress
+
+    return start()
+
+
+def runMigrationBatch(name):
+    """Migrate one batch, checkpoint the cursor and chain the next worker."""
+    migration = MIGRATIONS[name]
+    progress = MigrationProgress.get_by_id(name)
+    if not progress or progress.state != 'running':
+        return
+    start_cursor = progress.cursor
+    began = time.time()
+
+    entities, cursor, more = migration.query().fetch_page(
+        migration.batch_size,
+        start_cursor=Cursor(urlsafe=start_cursor) if start_cursor else None)
+    changed = []
+    for entity in entities:
+        changed.extend(migration.entitiesToWrite(entity))
+    if changed:
+        ndb.put_multi(changed)
+    migration.finishBatch(entities)
+
+    # wait long enough for this batch to stay under the target write rate
+    countdown = max(0, len(changed) / float(migration.writes_per_second)
+                    - (time.time() - began))
+
+    @ndb.transactional()
+    def checkpoint():
+        current = progress.key.get()
+        # a retried or duplicate worker already handled this batch
+        if current.state != 'running' or current.cursor != start_cursor:
+            return current
+        current.processed += len(entities)
+        current.updated += len(changed)
+        current.batches += 1
+        if more and cursor:
+            current.cursor = cursor.urlsafe()
+            _enqueue(name, countdown=int(round(countdown)), transactional=True)
+        else:
+            current.cursor = None
+            current.state = 'done'
+        current.put()
+        return current
+
+    current = checkpoint()
+    logging.info('migration %s: %s, %d processed, %d updated',
+                 name, current.state, current.processed, current.updated)
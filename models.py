@@ -17,16 +17,23 @@ import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
 
+import timeindex
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    lastModified = ndb.DateTimeProperty(auto_now=True)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -43,6 +50,8 @@ class ProfileForm(messages.Message):
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
 
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
@@ -60,6 +69,11 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    lastModified    = ndb.DateTimeProperty(auto_now=True)
+
+class ArchivedConference(Conference):
+    """ArchivedConference -- Conference past its endDate, moved out of the hot kind"""
+    callbacksDone   = ndb.BooleanProperty()
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -75,10 +89,50 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
+
+class ListView(messages.Enum):
+    """ListView -- list endpoint view enumeration value"""
+    FULL = 1
+    SUMMARY = 2
+
+class ResponseEncoding(messages.Enum):
+    """ResponseEncoding -- list endpoint response encoding enumeration value"""
+    JSON = 1
+    PROTOBUF = 2
+    COLUMNAR = 3
+
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- compact Conference outbound form message"""
+    name            = messages.StringField(1)
+    city            = messages.StringField(2)
+    startDate       = messages.StringField(3)
+    endDate         = messages.StringField(4)
+    seatsAvailable  = messages.IntegerField(5)
+    websafeKey      = messages.StringField(6)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    summaries = messages.MessageField(ConferenceSummaryForm, 2, repeated=True)
+    encoding = messages.EnumField('ResponseEncoding', 3)
+    payload = messages.BytesField(4)
+    columnar = messages.StringField(5)
+
+class ConferenceKeysForm(messages.Message):
+    """ConferenceKeysForm -- multiple websafe Conference keys inbound form message"""
+    websafeConferenceKeys = messages.StringField(1, repeated=True)
+
+class RegistrationForm(messages.Message):
+    """RegistrationForm -- single Conference registration outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    registered           = messages.BooleanField(2)
+    error                = messages.StringField(3)
+
+class RegistrationForms(messages.Message):
+    """RegistrationForms -- multiple Conference registration outbound form message"""
+    items = messages.MessageField(RegistrationForm, 1, repeated=True)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -107,6 +161,9 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    view = messages.EnumField('ListView', 2, default='FULL')
+    encoding = messages.EnumField('ResponseEncoding', 3, default='JSON')
+    includePast = messages.BooleanField(4, default=False)
 
 
 class SessionForm(messages.Message):
@@ -119,6 +176,8 @@ class SessionForm(messages.Message):
     date             = messages.StringField(6)
     startTime        = messages.StringField(7)
     urlsafeKey       = messages.StringField(8)
+    endTime          = messages.StringField(9)
+    conflicts        = messages.StringField(10, repeated=True)
 
 class Session(ndb.Model):
     """Session -- Session object"""
@@ -130,11 +189,162 @@ class Session(ndb.Model):
     typeOfSession   = ndb.StringProperty()
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
+    lastModified    = ndb.DateTimeProperty(auto_now=True)
+    # derived from duration, startTime and date on every put
+    durationMinutes = ndb.IntegerProperty()
+    endTime         = ndb.TimeProperty()
+    timeBuckets     = ndb.StringProperty(repeated=True)
+
+    def _pre_put_hook(self):
+        self.durationMinutes = timeindex.parseDuration(self.duration)
+        self.endTime = timeindex.endTime(self.startTime, self.durationMinutes)
+        self.timeBuckets = timeindex.hourBuckets(self.date, self.startTime, self.endTime)
+
+class SessionSummaryForm(messages.Message):
+    """SessionSummaryForm -- compact Session outbound form message"""
+    name             = messages.StringField(1)
+    speaker          = messages.StringField(2)
+    typeOfSession    = messages.StringField(3)
+    date             = messages.StringField(4)
+    startTime        = messages.StringField(5)
+    urlsafeKey       = messages.StringField(6)
+
+class ArchivedSession(Session):
+    """ArchivedSession -- Session of an ArchivedConference"""
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session  outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    summaries = messages.MessageField(SessionSummaryForm, 2, repeated=True)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
+    encoding = messages.EnumField('ResponseEncoding', 5)
+    payload = messages.BytesField(6)
+    columnar = messages.StringField(7)
+    nextPageToken = messages.StringField(8)
 
 class SessionWishlist(ndb.Model):
     """Session wishlist object """
     sessionKey  = ndb.StringProperty(required=True)
+    lastModified = ndb.DateTimeProperty(auto_now=True)
+
+class ExportJob(ndb.Model):
+    """ExportJob -- state of a bulk export, checkpointed after every batch"""
+    format          = ndb.StringProperty(required=True, choices=('json', 'csv'))
+    kinds           = ndb.StringProperty(repeated=True)
+    since           = ndb.DateTimeProperty()
+    state           = ndb.StringProperty(default='running',
+                                         choices=('running', 'done'))
+    kindIndex       = ndb.IntegerProperty(default=0)
+    cursor          = ndb.StringProperty(indexed=False)
+    chunkCounts     = ndb.JsonProperty()
+    entityCount     = ndb.IntegerProperty(default=0)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    lastModified    = ndb.DateTimeProperty(auto_now=True)
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- one batch of exported rows, child of ExportJob"""
+    kind            = ndb.StringProperty(indexed=False)
+    count           = ndb.IntegerProperty(indexed=False)
+    data            = ndb.BlobProperty(compressed=True)
+
+class MigrationProgress(ndb.Model):
+    """MigrationProgress -- checkpoint of a backfill, keyed by migration name"""
+    state           = ndb.StringProperty(default='running',
+                                         choices=('running', 'done'))
+    cursor          = ndb.StringProperty(indexed=False)
+    processed       = ndb.IntegerProperty(default=0)
+    updated         = ndb.IntegerProperty(default=0)
+    batches         = ndb.IntegerProperty(default=0)
+    started         = ndb.DateTimeProperty()
+    lastModified    = ndb.DateTimeProperty(auto_now=True)
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- search terms of its parent Conference or Session"""
+    docKind         = ndb.StringProperty()
+    name            = ndb.StringProperty(indexed=False)
+    terms           = ndb.StringProperty(repeated=True)
+    weights         = ndb.JsonProperty()
+
+class SearchResultForm(messages.Message):
+    """SearchResultForm -- single search hit outbound form message"""
+    kind            = messages.StringField(1)
+    websafeKey      = messages.StringField(2)
+    name            = messages.StringField(3)
+    score           = messages.FloatField(4)
+
+class SearchResultForms(messages.Message):
+    """SearchResultForms -- page of search hits outbound form message"""
+    items           = messages.MessageField(SearchResultForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
+
+class ConferenceDetailForm(messages.Message):
+    """ConferenceDetailForm -- Conference detail page outbound form message"""
+    conference          = messages.MessageField(ConferenceForm, 1)
+    isRegistered        = messages.BooleanField(2)
+    sessions            = messages.MessageField(SessionForm, 3, repeated=True)
+    wishlistSessionKeys = messages.StringField(4, repeated=True)
+    nextPageToken       = messages.StringField(5)
+
+class ConferenceStats(ndb.Model):
+    """ConferenceStats -- materialized counts of a Conference, its child"""
+    sessionCount        = ndb.IntegerProperty(default=0)
+    attendeeCount       = ndb.IntegerProperty(default=0)
+    sessionTypeCounts   = ndb.JsonProperty()
+    speakerCounts       = ndb.JsonProperty()
+    nextSessionId       = ndb.IntegerProperty(indexed=False)
+    lastModified        = ndb.DateTimeProperty(auto_now=True)
+
+class TypeCountForm(messages.Message):
+    """TypeCountForm -- sessions of one typeOfSession outbound form message"""
+    typeOfSession       = messages.StringField(1)
+    count               = messages.IntegerField(2)
+
+class ConferenceStatsForm(messages.Message):
+    """ConferenceStatsForm -- ConferenceStats outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    sessionCount        = messages.IntegerField(2)
+    attendeeCount       = messages.IntegerField(3)
+    speakerCount        = messages.IntegerField(4)
+    sessionTypes        = messages.MessageField(TypeCountForm, 5, repeated=True)
+
+class IdCounter(ndb.Model):
+    """IdCounter -- next free id of one kind under a parent, named after the kind"""
+    nextId              = ndb.IntegerProperty(indexed=False)
+    lastModified        = ndb.DateTimeProperty(auto_now=True)
+
+class FacetShard(ndb.Model):
+    """FacetShard -- one shard of the conference browser facet counts"""
+    counts              = ndb.JsonProperty(compressed=True)
+    lastModified        = ndb.DateTimeProperty(auto_now=True)
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- conferences having one filter value outbound form message"""
+    field               = messages.StringField(1)
+    value               = messages.StringField(2)
+    count               = messages.IntegerField(3)
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm -- facet counts of the conference browser outbound form message"""
+    field               = messages.StringField(1)
+    value               = messages.StringField(2)
+    total               = messages.IntegerField(3)
+    counts              = messages.MessageField(FacetCountForm, 4, repeated=True)
+
+class WishlistSchedule(ndb.Model):
+    """WishlistSchedule -- wishlisted session intervals of a Profile, its child"""
+    intervals           = ndb.JsonProperty()
+    longest             = ndb.IntegerProperty(default=0, indexed=False)
+    lastModified        = ndb.DateTimeProperty(auto_now=True)
+
+class TopicIndex(ndb.Model):
+    """TopicIndex -- sorted websafe keys of the conferences with a topic, keyed by topic"""
+    conferenceKeys      = ndb.BlobProperty(compressed=True)
+    count               = ndb.IntegerProperty(default=0, indexed=False)
+    lastModified        = ndb.DateTimeProperty(auto_now=True)
+
+class AgendaSnapshot(ndb.Model):
+    """AgendaSnapshot -- sorted sessions of a Conference as compressed JSON, its child"""
+    data                = ndb.BlobProperty()
+    sessionCount        = ndb.IntegerProperty(default=0, indexed=False)
+    lastModified        = ndb.DateTimeProperty(auto_now=True)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""ratelimit.py
+
+Conference Central per-user rate limiting of hot endpoints.
+
+Each (endpoint, user) pair has a token bucket of RATE_LIMITS[endpoint] =
+(requests per second, burst), kept as the generic cell rate algorithm's
+theoretical arrival time: a request is admitted while that time stays
+within burst / rate seconds of now, and pushes it 1 / rate seconds on.
+
+The check runs before the endpoint touches the datastore. Each instance
+first applies the bucket to its own requests, which can reject a client
+without any RPC, then the bucket shared through memcache (updated with
+compare-and-set) accounts for the client's requests to other instances.
+When memcache is unavailable requests are only limited per instance.
+
+"""
+
+import functools
+import os
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from models import TooManyRequestsException
+from utils import getUserId
+
+MEMCACHE_RATE_TPL = 'RATE:%s:%s'
+CAS_RETRIES = 3
+MAX_LOCAL_BUCKETS = 10000
+
+# endpoint method name -> (requests per second, burst)
+RATE_LIMITS = {
+    'queryConferences': (5.0, 20),
+    'queryConferencesByTopics': (5.0, 20),
+    'fullTextSearch': (5.0, 20),
+    'getConferenceFacets': (5.0, 20),
+    'getConferenceDetail': (10.0, 30),
+    'registerForConference': (1.0, 5),
+    'unregisterFromConference': (1.0, 5),
+    'registerForConferences': (0.2, 2),
+    'createSession': (1.0, 10),
+    'createSessions': (0.2, 2),
+    'addSessionToWishlist': (1.0, 10),
+}
+
+# theoretical arrival times of the buckets this instance has seen
+_local = {}
+
+
+def _client():
+    """Return the id of the calling user, or its address if anonymous."""
+    user = endpoints.get_current_user()
+    if user:
+        return getUserId(user)
+    return os.environ.get('REMOTE_ADDR', 'anonymous')
+
+
+def _admit(tat, now, rate, burst):
+    """Return the bucket's new theoretical arrival time if a request at
+    now is admitted, or None."""
+    new_tat = max(tat or 0.0, now) + 1.0 / rate
+    if new_tat - now > burst / rate:
+        return None
+    return new_tat
+
+
+def _admitLocal(key, now, rate, burst):
+    """Apply the bucket to this instance's requests."""
+    new_tat = _admit(_local.get(key), now, rate, burst)
+    if new_tat is None:
+        return False
+    if len(_local) >= MAX_LOCAL_BUCKETS and key not in _local:
+        _local.clear()
+    _local[key] = new_tat
+    return True
+
+
+def _admitShared(key, now, rate, burst):
+    """Apply the bucket shared by all instances through memcache."""
+    client = memcache.Client()
+    expiry = int(burst / rate) + 1
+    for _ in range(CAS_RETRIES):
+        tat = client.gets(key)
+        new_tat = _admit(tat, now, rate, burst)
+        if new_tat is None:
+            return False
+        if tat is None:
+            if client.add(key, new_tat, time=expiry):
+                return True
+        elif client.cas(key, new_tat, time=expiry):
+            return True
+    # heavy contention on one client's bucket or memcache unavailable;
+    # the instance bucket still applies
+    return True
+
+
+def checkRate(method):
+    """Raise TooManyRequestsException if the caller exceeded the rate
+    limit of an endpoint method."""
+    if method not in RATE_LIMITS:
+        return
+    rate, burst = RATE_LIMITS[method]
+    key = MEMCACHE_RATE_TPL % (method, _client())
+    now = time.time()
+    if not _admitLocal(key, now, rate, burst) or \
+            not _admitShared(key, now, rate, burst):
+        raise TooManyRequestsException(
+            'Too many %s requests, please retry later' % method)
+
+
+def limited(method):
+    """Decorator applying the rate limit of an endpoint method before
+    it runs; place it below @endpoints.method."""
+    @functools.wraps(method)
+    def wrapper(self, request):
+        checkRate(method.__name__)
+        return method(self, request)
+    return wrapper
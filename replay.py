@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+"""replay.py
+
+Replay captured Conference Central API traffic (see traffic.py) against a
+local testbed datastore, and compare the replays of two code versions.
+
+    python replay.py run LOGS... --seed EXPORT.ndjson... [--salt SALT]
+                     [--speedup 10] [--report report.json]
+    python replay.py compare base.json new.json
+
+run reads the TRAFFIC lines of the given request log files, seeds the
+testbed with the newline-delimited JSON files of a bulk export (export.py),
+anonymized with the capture's salt so captured keys and users resolve,
+and calls each captured ConferenceApi method in process, keeping the
+captured spacing divided by --speedup (0 replays back to back). The
+report holds per method the number of calls and outcomes, latency
+percentiles and the mean number of API calls (datastore, memcache, task
+queue) per request. Run it in two checkouts with the same inputs and
+compare the reports: RPC counts are exact, while testbed latencies are
+only indicative since every RPC is served in memory.
+
+Run with the App Engine SDK on the PYTHONPATH.
+
+"""
+
+import collections
+import json
+import optparse
+import os
+import sys
+import time
+from datetime import datetime
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import protojson
+
+import conference
+import facets
+import ratelimit
+import search
+import settings
+import topics
+import traffic
+
+SEED_BATCH_SIZE = 500
+# exported properties holding user ids or personal data
+USER_PROPERTIES = ('organizerUserId', 'mainEmail', 'displayName')
+# exported string properties holding websafe keys
+KEY_PROPERTIES = ('conferenceKeysToAttend', 'sessionKey')
+PERCENTILES = (50, 95, 99)
+
+
+def setUpTestbed():
+    """Activate in-memory service stubs, returning the testbed."""
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=os.path.dirname(os.path.abspath(__file__)))
+    bed.init_app_identity_stub()
+    bed.init_mail_stub()
+    bed.init_urlfetch_stub()
+    bed.init_user_stub()
+    return bed
+
+
+def _parseTime(text, fmt):
+    return datetime.strptime(text, fmt + ('.%f' if '.' in text else ''))
+
+
+def _decodeValue(prop, value, salt):
+    """Return the Python value of an exported property value."""
+    if value is None:
+        return None
+    name = prop._code_name
+    if name in USER_PROPERTIES:
+        return traffic.anonymizeUser(value, salt)
+    if name in KEY_PROPERTIES:
+        return _localKey(value, salt).urlsafe()
+    if isinstance(prop, ndb.KeyProperty):
+        return _localKey(value, salt)
+    if isinstance(prop, ndb.DateProperty):
+        return _parseTime(value, '%Y-%m-%d').date()
+    if isinstance(prop, ndb.TimeProperty):
+        return _parseTime(value, '%H:%M:%S').time()
+    if isinstance(prop, ndb.DateTimeProperty):
+        return _parseTime(value, '%Y-%m-%dT%H:%M:%S')
+    return value
+
+
+def _localKey(wsck, salt):
+    """Return the testbed key of an exported websafe key."""
+    return ndb.Key(pairs=traffic.anonymizePairs(ndb.Key(urlsafe=wsck).pairs(), salt))
+
+
+def seed(paths, salt):
+    """Load bulk export files into the testbed datastore, anonymized, and
+    build the search documents, topic index and facet counts of what was
+    loaded."""
+    batch = []
+    conf_keys = []
+    indexed = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                model = ndb.Model._lookup_model(row.pop('kind'))
+                key = _localKey(row.pop('key'), salt)
+                values = {}
+                for name, value in row.items():
+                    prop = model._properties.get(name)
+                    if prop is None:
+                        continue
+                    if prop._repeated:
+                        values[name] = [_decodeValue(prop, v, salt) for v in value or []]
+                    else:
+                        values[name] = _decodeValue(prop, value, salt)
+                entity = model(key=key, **values)
+                batch.append(entity)
+                if key.kind() == 'Conference':
+                    conf_keys.append(key.urlsafe())
+                if key.kind() in ('Conference', 'Session'):
+                    indexed.append(entity)
+                if len(batch) >= SEED_BATCH_SIZE:
+                    ndb.put_multi(batch)
+                    batch = []
+    ndb.put_multi(batch + [search.buildDocument(entity) for entity in indexed])
+    topics.updateIndex(conf_keys, [])
+    facets.rebuildFacets()
+    return len(indexed)
+
+
+def readCapture(paths):
+    """Return the captured calls of request log files, in start order."""
+    calls = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                start = line.find(traffic.LOG_PREFIX + '{')
+                if start >= 0:
+                    calls.append(json.loads(line[start + len(traffic.LOG_PREFIX):]))
+    calls.sort(key=lambda call: call['started'])
+    return calls
+
+
+def _localRequest(data):
+    """Replace the captured key paths of request data with testbed keys."""
+    if isinstance(data, dict):
+        if '$key' in data:
+            return ndb.Key(pairs=[tuple(pair) for pair in data['$key']]).urlsafe()
+        return dict((name, _localRequest(value)) for name, value in data.items())
+    if isinstance(data, list):
+        return [_localRequest(value) for value in data]
+    return data
+
+
+class RpcCounter(object):
+    """RpcCounter -- count API calls made through the apiproxy"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'replay_rpc_counter', self.hook)
+
+    def hook(self, service, call, request, response):
+        self.counts[service] += 1
+
+    def snapshot(self):
+        return collections.Counter(self.counts)
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = max(0, int(round(percent / 100.0 * len(ordered))) - 1)
+    return round(ordered[index], 2)
+
+
+def replay(calls, speedup, keep_rate_limits=False):
+    """Replay captured calls, returning the report dict."""
+    settings.TRAFFIC_CAPTURE_RATE = 0
+    if not keep_rate_limits:
+        # limits are tuned for real time; a sped-up replay would trip them
+        ratelimit.RATE_LIMITS.clear()
+
+    api = conference.ConferenceApi()
+    counter = RpcCounter()
+    stats = collections.defaultdict(lambda: {
+        'latencies': [], 'outcomes': collections.Counter(),
+        'rpcs': collections.Counter(), 'captured': []})
+    began = time.time()
+    first = calls[0]['started'] if calls else 0
+    for call in calls:
+        if speedup > 0:
+            delay = (call['started'] - first) / speedup - (time.time() - began)
+            if delay > 0:
+                time.sleep(delay)
+        method = getattr(api, call['method'], None)
+        entry = stats[call['method']]
+        entry['captured'].append(call['latencyMs'])
+        if method is None:
+            entry['outcomes']['missing'] += 1
+            continue
+        request = protojson.decode_message(method.remote.request_type,
+                                           json.dumps(_localRequest(call['request'])))
+        # every call is a new request with its own user and context
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = call['user'] or ''
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+        ndb.get_context().clear_cache()
+        before = counter.snapshot()
+        started = time.time()
+        try:
+            method(request)
+            outcome = 'ok'
+        except Exception as e:
+            outcome = type(e).__name__
+        entry['latencies'].append((time.time() - started) * 1000)
+        entry['outcomes'][outcome] += 1
+        entry['rpcs'].update(counter.snapshot() - before)
+
+    methods = {}
+    for name, entry in stats.items():
+        count = len(entry['captured'])
+        methods[name] = {
+            'calls': count,
+            'outcomes': dict(entry['outcomes']),
+            'latencyMs': dict(('p%d' % p, _percentile(entry['latencies'], p))
+                              for p in PERCENTILES),
+            'capturedLatencyMs': dict(('p%d' % p, _percentile(entry['captured'], p))
+                                      for p in PERCENTILES),
+            'rpcsPerCall': dict((service, round(total / float(count), 2))
+                                for service, total in entry['rpcs'].items()),
+        }
+    return {'calls': len(calls), 'speedup': speedup,
+            'seconds': round(time.time() - began, 1), 'methods': methods}
+
+
+def compare(base, new):
+    """Return the lines of a per-method comparison of two reports."""
+    lines = ['%-32s %8s %18s %18s  %s' % ('method', 'calls', 'p50 ms', 'p95 ms',
+                                            'rpcs per call')]
+    for name in sorted(set(base['methods']) | set(new['methods'])):
+        old = base['methods'].get(name)
+        cur = new['methods'].get(name)
+        if not old or not cur:
+            lines.append('%-32s only in %s' % (name, 'new' if cur else 'base'))
+            continue
+        latency = ['%7s -> %-7s' % (old['latencyMs'][p], cur['latencyMs'][p])
+                   for p in ('p50', 'p95')]
+        services = sorted(set(old['rpcsPerCall']) | set(cur['rpcsPerCall']))
+        rpcs = ', '.join('%s %s -> %s' % (service, old['rpcsPerCall'].get(service, 0),
+                                         cur['rpcsPerCall'].get(service, 0))
+                         for service in services
+                         if old['rpcsPerCall'].get(service) != cur['rpcsPerCall'].get(service))
+        lines.append('%-32s %8d %18s %18s  %s' % (name, cur['calls'], latency[0],
+                                                  latency[1], rpcs or 'same'))
+        if old['outcomes'] != cur['outcomes']:
+            lines.append('%-32s outcomes %s -> %s' % ('', old['outcomes'], cur['outcomes']))
+    return lines
+
+
+def main(argv):
+    parser = optparse.OptionParser(
+        usage='%prog run LOGS... --seed EXPORT... | %prog compare BASE NEW')
+    parser.add_option('--seed', action='append', default=[], metavar='FILE',
+                      help='bulk export file (json format) to load first')
+    parser.add_option('--salt', default='',
+                      help='settings.TRAFFIC_CAPTURE_SALT of the capture')
+    parser.add_option('--speedup', type='float', default=1.0,
+                      help='replay speed relative to capture; 0 for no waits')
+    parser.add_option('--report', metavar='FILE', help='write the report to FILE')
+    parser.add_option('--keep-rate-limits', action='store_true',
+                      help='apply ratelimit.RATE_LIMITS during the replay')
+    options, args = parser.parse_args(argv)
+
+    if args[:1] == ['compare'] and len(args) == 3:
+        with open(args[1]) as f:
+            base = json.load(f)
+        with open(args[2]) as f:
+            new = json.load(f)
+        sys.stdout.write('\n'.join(compare(base, new)) + '\n')
+        return
+    if args[:1] != ['run'] or len(args) < 2:
+        parser.error('expected run or compare')
+
+    bed = setUpTestbed()
+    try:
+        seeded = seed(options.seed, options.salt)
+        calls = readCapture(args[1:])
+        sys.stderr.write('seeded %d conferences and sessions, replaying %d calls\n'
+                         % (seeded, len(calls)))
+        report = replay(calls, options.speedup, options.keep_rate_limits)
+    finally:
+        bed.deactivate()
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.report:
+        with open(options.report, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Conference Central schedule conflicts of session wishlists.
+
+A WishlistSchedule child of each Profile holds the intervals of its
+wishlisted sessions as [start, end, sessionKey] lists, in minutes since
+the start of the proleptic calendar and sorted by start. Sessions never
+run past the end of their day, so a new session only has to be compared
+with the intervals of its own day starting in [start - longest, end),
+with longest the length of the longest interval. They are found by
+bisection, so a conflict check costs O(log n + k), k being bounded by
+the wishlisted sessions of that day rather than by the whole wishlist.
+
+"""
+
+import bisect
+from datetime import time
+
+from google.appengine.ext import ndb
+
+from models import SessionWishlist
+from models import WishlistSchedule
+import archive
+import timeindex
+
+SCHEDULE_ID = 'schedule'
+MINUTES_PER_DAY = 24 * 60
+
+
+def scheduleKey(p_key):
+    """Return the WishlistSchedule key of a profile."""
+    return ndb.Key(WishlistSchedule, SCHEDULE_ID, parent=p_key)
+
+
+def _minutes(t):
+    """Return a time of day in minutes, the end of the day being 1440."""
+    if t == time.max:
+        return MINUTES_PER_DAY
+    return t.hour * 60 + t.minute
+
+
+def sessionInterval(session):
+    """Return the [start, end, sessionKey] interval of a session, or None
+    for a session without a date or startTime."""
+    if not session or not session.date or not session.startTime:
+        return None
+    end = session.endTime or timeindex.endTime(
+        session.startTime, timeindex.parseDuration(session.duration))
+    day = session.date.toordinal() * MINUTES_PER_DAY
+    return [day + _minutes(session.startTime),
+            day + max(_minutes(end), _minutes(session.startTime)),
+            session.key.urlsafe()]
+
+
+def overlaps(a, b):
+    """Return True if two intervals overlap.
+
+    Sessions without a duration are instants, which conflict with
+    sessions starting at the same minute.
+    """
+    return a[0] == b[0] or (a[0] < b[1] and b[0] < a[1])
+
+
+def conflicts(schedule, interval):
+    """Return the intervals of a schedule that overlap interval."""
+    # intervals of earlier days end before interval's day starts; one-
+    # element lists sort before every interval with the same start
+    day = interval[0] - interval[0] % MINUTES_PER_DAY
+    lo = bisect.bisect_left(schedule.intervals,
+                            [max(interval[0] - schedule.longest, day)])
+    hi = bisect.bisect_right(schedule.intervals, [interval[1], float('inf')])
+    return [entry for entry in schedule.intervals[lo:hi]
+            if entry[2] != interval[2] and overlaps(entry, interval)]
+
+
+def addInterval(schedule, interval):
+    """Insert an interval into a schedule, keeping it sorted by start."""
+    bisect.insort(schedule.intervals, interval)
+    schedule.longest = max(schedule.longest, interval[1] - interval[0])
+
+
+def buildSchedule(p_key):
+    """Return the schedule of a profile computed from its wishlist."""
+    wishlist = SessionWishlist.query(ancestor=p_key).fetch()
+    sessions = archive.getWithArchive(
+        [ndb.Key(urlsafe=wish.sessionKey) for wish in wishlist])
+    schedule = WishlistSchedule(key=scheduleKey(p_key), intervals=[], longest=0)
+    for session in sessions:
+        interval = sessionInterval(session)
+        if interval:
+            addInterval(schedule, interval)
+    return schedule
+
+
+def loadSchedule(p_key):
+    """Return the schedule of a profile, computing a missing one."""
+    return scheduleKey(p_key).get() or buildSchedule(p_key)
+
+
+def addToWishlist(wishlist, session):
+    """Write a SessionWishlist entry and add its session to the schedule of
+    the profile in one transaction, returning the session keys the new
+    session conflicts with."""
+    p_key = wishlist.key.parent()
+    interval = sessionInterval(session)
+    # a profile without a schedule yet has it built outside the
+    # transaction, since its sessions live in other entity groups
+    built = None if scheduleKey(p_key).get() else buildSchedule(p_key)
+
+    @ndb.transactional()
+    def add():
+        schedule, existing = ndb.get_multi([scheduleKey(p_key), wishlist.key])
+        if existing:
+            # the entry is named after its session; a concurrent add of
+            # the same session already counted it
+            return []
+        if not schedule:
+            # copied so a retried transaction starts from the built one
+            schedule = WishlistSchedule(key=built.key, longest=built.longest,
+                                        intervals=list(built.intervals))
+        found = []
+        if interval:
+            found = conflicts(schedule, interval)
+            addInterval(schedule, interval)
+        ndb.put_multi([wishlist, schedule])
+        return found
+
+    return [entry[2] for entry in add()]
+
+
+def itinerary(schedule):
+    """Return the session keys of a largest conflict-free subset of a
+    schedule, in start order.
+
+    Greedily keeps the session ending first that starts no earlier than
+    the end of the last one kept.
+    """
+    kept = []
+    for entry in sorted(schedule.intervals, key=lambda entry: (entry[1], entry[0])):
+        if not kept or not overlaps(kept[-1], entry) and entry[0] >= kept[-1][1]:
+            kept.append(entry)
+    return [entry[2] for entry in kept]
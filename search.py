@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Conference Central prefix and full-text search over conference and
+session names, descriptions, highlights and speakers.
+
+Every searchable entity has a SearchDocument child holding its tokens and
+their prefixes in one repeated, indexed property. A search is a single
+query with one equality filter per search term, which the datastore
+answers by merge-joining the built-in single-property index, followed by
+in-memory ranking of every matching document. Matches are read
+SCAN_PAGE_SIZE at a time and only the best ones up to the requested page
+are kept, so the ranking covers the whole match set. Because the
+document lives in its entity's group it can be written in the same
+transaction and put_multi as the entity itself.
+
+"""
+
+import heapq
+import re
+
+from google.appengine.ext import ndb
+
+from models import SearchDocument
+
+MIN_PREFIX = 2
+MAX_PREFIX = 12
+MAX_QUERY_TERMS = 8
+SCAN_PAGE_SIZE = 500
+EXACT_MATCH_BOOST = 2.0
+
+# weight of a token by the field it was found in
+FIELD_WEIGHTS = {
+    'Conference': (('name', 3.0), ('description', 1.0)),
+    'Session': (('name', 3.0), ('speaker', 2.0), ('highlights', 1.0)),
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Return the lowercase word tokens of text."""
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+def _prefixes(token):
+    """Return token and its prefixes down to MIN_PREFIX characters."""
+    prefixes = set([token])
+    for length in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1):
+        prefixes.add(token[:length])
+    return prefixes
+
+
+def documentKey(entity_key):
+    """Return the SearchDocument key of an entity."""
+    return ndb.Key(SearchDocument, 'search', parent=entity_key)
+
+
+def buildDocument(entity):
+    """Return the SearchDocument indexing a Conference or Session."""
+    kind = entity.key.kind()
+    weights = {}
+    for field, weight in FIELD_WEIGHTS[kind]:
+        for token in tokenize(getattr(entity, field)):
+            weights[token] = weights.get(token, 0) + weight
+    terms = set()
+    for token in weights:
+        terms.update(_prefixes(token))
+    return SearchDocument(key=documentKey(entity.key), docKind=kind,
+                          name=entity.name, terms=sorted(terms),
+                          weights=weights)
+
+
+def _score(doc, tokens):
+    """Rank a candidate by the weight of the tokens the query matched."""
+    score = 0.0
+    for query_token in tokens:
+        best = 0.0
+        for token, weight in doc.weights.items():
+            if token == query_token:
+                best = max(best, weight * EXACT_MATCH_BOOST)
+            elif token.startswith(query_token):
+                best = max(best, weight)
+        if not best:
+            return 0.0
+        score += best
+    return score
+
+
+def search(text, kind=None, offset=0, limit=20):
+    """Return a page of (SearchDocument, score) for a query, best first,
+    and whether more results follow.
+
+    Every word of the query must match the start of a word in the
+    document.
+    """
+    tokens = []
+    for token in tokenize(text):
+        if len(token) >= MIN_PREFIX and token not in tokens:
+            tokens.append(token)
+    tokens = tokens[:MAX_QUERY_TERMS]
+    if not tokens:
+        return [], False
+
+    q = SearchDocument.query()
+    for token in tokens:
+        # prefixes longer than MAX_PREFIX are not indexed; the truncated
+        # term still matches and the ranking below uses the whole token
+        q = q.filter(SearchDocument.terms == token[:MAX_PREFIX])
+    if kind:
+        q = q.filter(SearchDocument.docKind == kind)
+
+    scored = ((doc, _score(doc, tokens)) for doc in _scan(q))
+    ranked = heapq.nsmallest(offset + limit + 1,
+                             ((doc, score) for doc, score in scored if score > 0),
+                             key=lambda (doc, score): (-score, doc.name))
+    return ranked[offset:offset + limit], len(ranked) > offset + limit
+
+
+def _scan(q):
+    """Yield every result of q, SCAN_PAGE_SIZE at a time."""
+    cursor = None
+    more = True
+    while more:
+        page, cursor, more = q.fetch_page(SCAN_PAGE_SIZE, start_cursor=cursor)
+        for doc in page:
+            yield doc
@@ -16,3 +16,8 @@ WEB_CLIENT_ID = '942213791788-amreps3i4mdhv6d646ufm82t1jhqgn8j.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Fraction of API calls logged for replay.py (0 disables the capture), and
+# the salt of the hashes that anonymize user ids in the capture.
+TRAFFIC_CAPTURE_RATE = 0.0
+TRAFFIC_CAPTURE_SALT = ''
@@ -550,16 +550,21 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
     $scope.conference = {};
 
+    $scope.sessions = [];
+
+    $scope.wishlistSessionKeys = [];
+
     $scope.isUserAttending = false;
 
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConferenceDetail method, which returns the conference, whether the user
+     * is attending it and the first page of its sessions in one response, and sets them in the $scope.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        gapi.client.conference.getConferenceDetail({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
@@ -574,33 +579,57 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 } else {
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
+                    $scope.conference = resp.result.conference;
+                    $scope.sessions = resp.result.sessions || [];
+                    $scope.wishlistSessionKeys = resp.result.wishlistSessionKeys || [];
+                    if (resp.result.nextPageToken) {
+                        $scope.loadMoreSessions(resp.result.nextPageToken);
+                    }
+                    if (resp.result.isRegistered) {
+                        // The user is attending the conference.
+                        $scope.alertStatus = 'info';
+                        $scope.messages = 'You are attending this conference';
+                        $scope.isUserAttending = true;
+                    }
                 }
             });
         });
+    };
 
-        $scope.loading = true;
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+    /**
+     * Appends the sessions of the conference from the page token on, one page per
+     * conference.getConferenceSessions call.
+     *
+     * @param pageToken
+     */
+    $scope.loadMoreSessions = function (pageToken) {
+        gapi.client.conference.getConferenceSessions({
+            websafeConferenceKey: $routeParams.websafeConferenceKey,
+            pageToken: pageToken
+        }).execute(function (resp) {
             $scope.$apply(function () {
-                $scope.loading = false;
                 if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
-                        }
-                    }
+                    $log.error('Failed to get more sessions : ' + (resp.error.message || ''));
+                    return;
+                }
+                $scope.sessions = $scope.sessions.concat(resp.result.items || []);
+                if (resp.result.nextPageToken) {
+                    $scope.loadMoreSessions(resp.result.nextPageToken);
                 }
             });
         });
     };
 
+    /**
+     * Returns true if the session is in the user's wishlist.
+     *
+     * @param session
+     * @returns {boolean}
+     */
+    $scope.isInWishlist = function (session) {
+        return $scope.wishlistSessionKeys.indexOf(session.urlsafeKey) != -1;
+    };
+
 
     /**
      * Invokes the conference.registerForConference method.
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+"""base.py
+
+Common test case of the Conference Central tests: every test runs against
+fresh in-memory service stubs (see replay.setUpTestbed).
+
+"""
+
+import os
+import unittest
+
+from google.appengine.ext import ndb
+
+import replay
+
+
+class AppEngineTestCase(unittest.TestCase):
+    """AppEngineTestCase -- test case with its own testbed"""
+
+    def setUp(self):
+        self.testbed = replay.setUpTestbed()
+        self.taskqueue = self.testbed.get_stub('taskqueue')
+        ndb.get_context().set_cache_policy(False)
+        ndb.get_context().set_memcache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+        for name in ('ENDPOINTS_AUTH_EMAIL', 'ENDPOINTS_AUTH_DOMAIN'):
+            os.environ.pop(name, None)
+
+    def login(self, email):
+        """Make email the user of the following endpoint calls."""
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+
+    def tasks(self, url=None):
+        """Return the queued tasks of the default queue, or those of url."""
+        tasks = self.taskqueue.get_filtered_tasks()
+        return [task for task in tasks if url is None or task.url == url]
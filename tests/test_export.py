@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""test_export.py
+
+Tests of the cursor-chained bulk export.
+
+"""
+
+import json
+import time
+import unittest
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from models import ExportChunk
+from models import ExportJob
+from models import Profile
+import export
+from tests.base import AppEngineTestCase
+
+
+class ExportTest(AppEngineTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.batch_size = export.EXPORT_BATCH_SIZE
+        export.EXPORT_BATCH_SIZE = 2
+        self.putProfiles(range(5))
+
+    def tearDown(self):
+        export.EXPORT_BATCH_SIZE = self.batch_size
+        super(ExportTest, self).tearDown()
+
+    def putProfiles(self, numbers):
+        ndb.put_multi([Profile(id='user%d@example.com' % i, displayName='User %d' % i,
+                               mainEmail='user%d@example.com' % i)
+                       for i in numbers])
+
+    def runToEnd(self, job):
+        for _ in range(20):
+            if job.key.get().state != 'running':
+                break
+            export.runExportBatch(job.key.id())
+        return job.key.get()
+
+    def testChunkSequencing(self):
+        job = self.runToEnd(export.startExport(kinds=['Profile']))
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.entityCount, 5)
+        self.assertEqual(job.chunkCounts, {'Profile': 3})
+        chunks = ExportChunk.query(ancestor=job.key).fetch()
+        self.assertEqual([chunk.key.id() for chunk in chunks],
+                         ['Profile-000000', 'Profile-000001', 'Profile-000002'])
+        self.assertEqual([chunk.count for chunk in chunks], [2, 2, 1])
+
+        rows = [json.loads(line) for data in export.iterExport(job, 'Profile')
+                for line in data.splitlines()]
+        self.assertEqual(sorted(row['mainEmail'] for row in rows),
+                         ['user%d@example.com' % i for i in range(5)])
+        self.assertTrue(all(row['kind'] == 'Profile' for row in rows))
+
+    def testDuplicateWorkerIsNoop(self):
+        job = export.startExport(kinds=['Profile'])
+        serialize = export._serialize
+        duplicates = []
+
+        def serializeTwice(*args, **kwargs):
+            # another worker for the same batch checkpoints first
+            if not duplicates:
+                duplicates.append(args)
+                export.runExportBatch(job.key.id())
+            return serialize(*args, **kwargs)
+
+        export._serialize = serializeTwice
+        try:
+            export.runExportBatch(job.key.id())
+        finally:
+            export._serialize = serialize
+        job = job.key.get()
+        self.assertEqual(job.chunkCounts, {'Profile': 1})
+        self.assertEqual(job.entityCount, 2)
+        self.assertEqual(ExportChunk.query(ancestor=job.key).count(), 1)
+
+    def testCsvHeaderOnlyInFirstChunk(self):
+        job = self.runToEnd(export.startExport(fmt='csv', kinds=['Profile']))
+        chunks = list(export.iterExport(job, 'Profile'))
+        self.assertEqual(len(chunks), 3)
+        header = chunks[0].splitlines()[0]
+        self.assertEqual(header.split(','), export._columns('Profile'))
+        self.assertTrue(header.startswith('key,'))
+        lines = ''.join(chunks).splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(sum(line == header for line in lines), 1)
+
+    def testSinceOnlyExportsModifiedEntities(self):
+        time.sleep(0.01)
+        since = datetime.now()
+        time.sleep(0.01)
+        self.putProfiles([1, 7])
+        job = self.runToEnd(export.startExport(kinds=['Profile'], since=since))
+        self.assertEqual(job.entityCount, 2)
+        rows = [json.loads(line) for data in export.iterExport(job, 'Profile')
+                for line in data.splitlines()]
+        self.assertEqual(sorted(row['mainEmail'] for row in rows),
+                         ['user1@example.com', 'user7@example.com'])
+
+    def testUnknownKindOrFormat(self):
+        with self.assertRaises(ValueError):
+            export.startExport(kinds=['SearchDocument'])
+        with self.assertRaises(ValueError):
+            export.startExport(fmt='xml')
+        self.assertEqual(ExportJob.query().count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""test_migrations.py
+
+Tests of the resumable migration framework.
+
+"""
+
+import time
+import unittest
+
+from google.appengine.ext import ndb
+
+from models import MigrationProgress
+from models import Profile
+import migrations
+from tests.base import AppEngineTestCase
+
+NAME = 'test-touch-profiles'
+
+
+class TouchProfiles(migrations.TouchMigration):
+    name = NAME
+    kind = 'Profile'
+    batch_size = 2
+
+
+class MigrationTest(AppEngineTestCase):
+
+    def setUp(self):
+        super(MigrationTest, self).setUp()
+        self.migration = migrations.MIGRATIONS[NAME] = TouchProfiles()
+        ndb.put_multi([Profile(id='user%d@example.com' % i, displayName='User %d' % i)
+                       for i in range(5)])
+
+    def tearDown(self):
+        del migrations.MIGRATIONS[NAME]
+        super(MigrationTest, self).tearDown()
+
+    def progress(self):
+        return MigrationProgress.get_by_id(NAME)
+
+    def runToEnd(self):
+        for _ in range(10):
+            if self.progress().state != 'running':
+                break
+            migrations.runMigrationBatch(NAME)
+        return self.progress()
+
+    def testUnknownMigration(self):
+        with self.assertRaises(ValueError):
+            migrations.startMigration('no-such-migration')
+
+    def testCheckpointAndResume(self):
+        migrations.startMigration(NAME)
+        self.assertEqual(len(self.tasks(migrations.MIGRATION_TASK_URL)), 1)
+
+        migrations.runMigrationBatch(NAME)
+        progress = self.progress()
+        self.assertEqual(progress.state, 'running')
+        self.assertEqual(progress.processed, 2)
+        self.assertEqual(progress.batches, 1)
+        self.assertTrue(progress.cursor)
+        # the next worker was chained with the checkpoint
+        self.assertEqual(len(self.tasks(migrations.MIGRATION_TASK_URL)), 2)
+
+        # resuming a running migration continues from its cursor
+        migrations.startMigration(NAME)
+        self.assertEqual(self.progress().cursor, progress.cursor)
+
+        progress = self.runToEnd()
+        self.assertEqual(progress.state, 'done')
+        self.assertEqual(progress.processed, 5)
+        self.assertEqual(progress.updated, 5)
+        self.assertEqual(progress.batches, 3)
+        self.assertIsNone(progress.cursor)
+
+    def testDuplicateWorkerIsNoop(self):
+        migrations.startMigration(NAME)
+        duplicates = []
+
+        def finishBatch(entities):
+            # another worker for the same batch checkpoints first
+            if not duplicates:
+                duplicates.append(entities)
+                migrations.runMigrationBatch(NAME)
+        self.migration.finishBatch = finishBatch
+
+        migrations.runMigrationBatch(NAME)
+        progress = self.progress()
+        self.assertEqual(progress.processed, 2)
+        self.assertEqual(progress.batches, 1)
+        # only the worker that checkpointed chained a successor
+        self.assertEqual(len(self.tasks(migrations.MIGRATION_TASK_URL)), 2)
+
+    def testWorkerOfStoppedMigrationIsNoop(self):
+        migrations.startMigration(NAME)
+        self.runToEnd()
+        migrations.runMigrationBatch(NAME)
+        self.assertEqual(self.progress().processed, 5)
+
+    def testThrottleCountdown(self):
+        self.migration.writes_per_second = 1
+        migrations.startMigration(NAME)
+        migrations.runMigrationBatch(NAME)
+        task = self.tasks(migrations.MIGRATION_TASK_URL)[-1]
+        # two writes at one write per second delay the next worker ~2s
+        self.assertAlmostEqual(task.eta_posix - time.time(), 2, delta=1)
+
+    def testRestartAfterDone(self):
+        migrations.startMigration(NAME)
+        self.runToEnd()
+        queued = len(self.tasks(migrations.MIGRATION_TASK_URL))
+
+        # a finished migration is only run again on restart
+        progress = migrations.startMigration(NAME)
+        self.assertEqual(progress.state, 'done')
+        self.assertEqual(len(self.tasks(migrations.MIGRATION_TASK_URL)), queued)
+
+        progress = migrations.startMigration(NAME, restart=True)
+        self.assertEqual(progress.state, 'running')
+        self.assertEqual(progress.processed, 0)
+        self.assertIsNone(progress.cursor)
+        self.assertEqual(len(self.tasks(migrations.MIGRATION_TASK_URL)), queued + 1)
+        self.assertEqual(self.runToEnd().processed, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
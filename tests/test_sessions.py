@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""test_sessions.py
+
+Tests of session creation.
+
+"""
+
+import unittest
+from datetime import date
+from datetime import time
+
+import endpoints
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import SessionForm
+import aggregates
+import conference
+from tests.base import AppEngineTestCase
+
+ORGANIZER = 'organizer@example.com'
+
+
+class CreateSessionTest(AppEngineTestCase):
+
+    def setUp(self):
+        super(CreateSessionTest, self).setUp()
+        self.login(ORGANIZER)
+        p_key = ndb.Key(Profile, ORGANIZER)
+        Profile(key=p_key, displayName='Organizer', mainEmail=ORGANIZER).put()
+        self.conf = Conference(key=ndb.Key(Conference, 1, parent=p_key),
+                               name='PyCon', organizerUserId=ORGANIZER,
+                               city='Paris', topics=['Python'], month=6,
+                               startDate=date(2030, 6, 1), endDate=date(2030, 6, 3),
+                               maxAttendees=10, seatsAvailable=10)
+        self.conf.put()
+        self.api = conference.ConferenceApi()
+
+    def sessionFields(self, **fields):
+        values = dict(name='Keynote', speaker='Guido', duration='90',
+                      typeOfSession='Keynote', date='2030-06-01', startTime='09:00:00')
+        values.update(fields)
+        return values
+
+    def testCreateSession(self):
+        request = conference.SESSION_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=self.conf.key.urlsafe(), **self.sessionFields())
+        form = self.api.createSession(request)
+
+        sessions = Session.query(ancestor=self.conf.key).fetch()
+        self.assertEqual(len(sessions), 1)
+        session = sessions[0]
+        self.assertEqual(form.urlsafeKey, session.key.urlsafe())
+        self.assertEqual(session.name, 'Keynote')
+        self.assertEqual(session.startTime, time(9, 0))
+        self.assertEqual(session.endTime, time(10, 30))
+        self.assertEqual(aggregates.statsKey(self.conf.key).get().sessionCount, 1)
+
+    def testCreateSessions(self):
+        request = conference.SESSIONS_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=self.conf.key.urlsafe(),
+            items=[SessionForm(**self.sessionFields()),
+                   SessionForm(**self.sessionFields(name='Tutorial', typeOfSession='Workshop',
+                                                    startTime='11:00:00'))])
+        forms = self.api.createSessions(request)
+
+        self.assertEqual(len(forms.items), 2)
+        names = sorted(session.name for session in
+                       Session.query(ancestor=self.conf.key))
+        self.assertEqual(names, ['Keynote', 'Tutorial'])
+        # both sessions got their own id under the conference
+        self.assertEqual(len(set(form.urlsafeKey for form in forms.items)), 2)
+
+    def testBatchLargerThanOneCommit(self):
+        request = conference.SESSIONS_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=self.conf.key.urlsafe(),
+            items=[SessionForm(**self.sessionFields())
+                   for _ in range(conference.MAX_SESSIONS_PER_COMMIT + 1)])
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.createSessions(request)
+        self.assertEqual(Session.query(ancestor=self.conf.key).count(), 0)
+
+    def testSessionOutsideConferenceDates(self):
+        request = conference.SESSION_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=self.conf.key.urlsafe(), name='Late',
+            date='2030-07-01', startTime='09:00:00')
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.createSession(request)
+        self.assertEqual(Session.query(ancestor=self.conf.key).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""timeindex.py
+
+Conference Central typed session durations and the day/hour bucket index.
+
+Session.duration is free-form text ("90", "1h30m", "1:30", "2 hours").
+parseDuration() turns it into minutes, from which a Session derives its
+endTime and the hour buckets ("2015-06-01T14") it overlaps. A time window
+query then only reads the sessions in the window's buckets.
+
+"""
+
+import re
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+
+BUCKET_FORMAT = '%Y-%m-%dT%H'
+
+CLOCK_RE = re.compile(r'^\s*(\d+):(\d{1,2})\s*$')
+PART_RE = re.compile(r'(\d+(?:\.\d+)?)\s*([a-z]*)')
+HOUR_UNITS = ('h', 'hr', 'hrs', 'hour', 'hours')
+MINUTE_UNITS = ('', 'm', 'min', 'mins', 'minute', 'minutes')
+
+
+def parseDuration(text):
+    """Return a free-form duration in whole minutes, or None."""
+    if not text:
+        return None
+    text = text.strip().lower()
+    match = CLOCK_RE.match(text)
+    if match:
+        return int(match.group(1)) * 60 + int(match.group(2))
+    minutes = 0.0
+    parts = PART_RE.findall(text)
+    if not parts:
+        return None
+    for number, unit in parts:
+        if unit in HOUR_UNITS:
+            minutes += float(number) * 60
+        elif unit in MINUTE_UNITS:
+            minutes += float(number)
+        else:
+            return None
+    return int(round(minutes))
+
+
+def endTime(start, minutes):
+    """Return the end time of a session, capped at the end of its day."""
+    if start is None:
+        return None
+    end = datetime.combine(datetime.min.date(), start) + timedelta(minutes=minutes or 0)
+    if end.date() != datetime.min.date():
+        return time.max
+    return end.time()
+
+
+def hourBuckets(day, start, end):
+    """Return the hour buckets a [start, end) interval on day overlaps.
+
+    An instant (start == end) falls in the bucket of its hour.
+    """
+    if day is None or start is None:
+        return []
+    last = end.hour if end and end > start else start.hour
+    # an interval ending on the hour does not reach into that hour
+    if end and end > start and end.minute == 0 and end.second == 0:
+        last = max(start.hour, last - 1)
+    return [datetime.combine(day, time(hour)).strftime(BUCKET_FORMAT)
+            for hour in range(start.hour, last + 1)]
+
+
+def overlaps(start, end, window_start, window_end):
+    """Return True if [start, end) overlaps [window_start, window_end).
+
+    Sessions without a duration count as an instant at their start.
+    """
+    if start is None:
+        return False
+    if end is None or end <= start:
+        return window_start <= start < window_end
+    return start < window_end and end > window_start
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""topics.py
+
+Conference Central topic -> conference inverted index.
+
+A TopicIndex entity per topic holds the sorted websafe keys of the
+current conferences with that topic, newline separated and compressed.
+Queries over several topics read one entity per topic with a single
+get_multi and combine the key lists with set operations in memory,
+instead of running one Conference query per topic.
+
+Conference writes only enqueue a reindex task for the conferences they
+touched, along with the topics they had before. The worker reconciles
+each affected topic with the conferences as currently stored, so tasks
+are idempotent and may run in any order.
+
+"""
+
+from collections import Counter
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import TopicIndex
+import archive
+
+TOPIC_TASK_URL = '/tasks/index_topics'
+
+
+def _decode(index):
+    """Return the set of websafe conference keys of a TopicIndex."""
+    if not index or not index.conferenceKeys:
+        return set()
+    return set(index.conferenceKeys.split('\n'))
+
+
+def _encode(keys):
+    """Return the stored form of a set of websafe conference keys."""
+    return '\n'.join(sorted(keys))
+
+
+def topicKeys(topics):
+    """Return a dict mapping each topic to its set of websafe conference keys."""
+    topics = [topic for topic in set(topics) if topic]
+    indexes = ndb.get_multi([ndb.Key(TopicIndex, topic) for topic in topics])
+    return dict((topic, _decode(index)) for topic, index in zip(topics, indexes))
+
+
+def conferencesWithTopics(topics, matchAll=True):
+    """Return the keys of the conferences having all (or any) of topics."""
+    sets = topicKeys(topics).values()
+    if not sets:
+        return []
+    if matchAll:
+        matching = set.intersection(*sets)
+    else:
+        matching = set.union(*sets)
+    return [ndb.Key(urlsafe=wsck) for wsck in sorted(matching)]
+
+
+def relatedConferences(conferences, limit):
+    """Return the keys of the conferences sharing the most topics with
+    conferences, excluding those, most shared topics first."""
+    exclude = set(conf.key.urlsafe() for conf in conferences)
+    topics = set()
+    for conf in conferences:
+        topics.update(conf.topics)
+    overlap = Counter()
+    for keys in topicKeys(topics).values():
+        overlap.update(keys - exclude)
+    ranked = sorted(overlap.items(), key=lambda (wsck, count): (-count, wsck))
+    return [ndb.Key(urlsafe=wsck) for wsck, count in ranked[:limit]]
+
+
+def reindexConferences(c_keys, old_topics=(), transactional=False):
+    """Enqueue the reindexing of conferences whose topics may have changed;
+    old_topics are the topics they had before the change."""
+    if not c_keys:
+        return
+    taskqueue.add(params={'conference': [c_key.urlsafe() for c_key in c_keys],
+                          'topic': [topic for topic in set(old_topics) if topic]},
+                  url=TOPIC_TASK_URL, transactional=transactional)
+
+
+def updateIndex(wscks, old_topics):
+    """Reconcile the topics of conferences and the index entries of their
+    current and old topics (task)."""
+    confs = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in wscks])
+    current = dict((wsck, set(conf.topics) if conf else set())
+                   for wsck, conf in zip(wscks, confs))
+    topics = set(old_topics)
+    for conf_topics in current.values():
+        topics.update(conf_topics)
+
+    @ndb.transactional()
+    def update(topic):
+        key = ndb.Key(TopicIndex, topic)
+        index = key.get()
+        before = _decode(index)
+        keys = set(before)
+        for wsck, conf_topics in current.items():
+            if topic in conf_topics:
+                keys.add(wsck)
+            else:
+                keys.discard(wsck)
+        if keys == before:
+            return
+        if not keys:
+            key.delete()
+            return
+        TopicIndex(key=key, conferenceKeys=_encode(keys), count=len(keys)).put()
+
+    for topic in topics:
+        if topic:
+            update(topic)
+
+
+# archived conferences leave the index of current conferences
+archive.ON_ARCHIVE.append(
+    lambda conf: reindexConferences([conf.key], conf.topics))
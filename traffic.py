@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""traffic.py
+
+Conference Central capture of API traffic for replay (see replay.py).
+
+When settings.TRAFFIC_CAPTURE_RATE is above zero, that fraction of
+ConferenceApi calls is logged as one "TRAFFIC {json}" line holding the
+method name, the request message, the caller, the start time, the
+latency and the outcome. Capture is off by default.
+
+Captured traffic is anonymized: user ids (emails) are replaced by salted
+hashes that still look like emails, datastore keys are stored as their
+path with Profile ids anonymized the same way, and personal fields and
+page tokens are dropped or hashed. replay.py applies the same mapping
+to an export, so a replay finds the entities the captured calls used.
+
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import random
+import time
+
+import endpoints
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+import settings
+
+LOG_PREFIX = 'TRAFFIC '
+ANONYMOUS_DOMAIN = 'anon.invalid'
+
+# request fields holding websafe keys
+KEY_FIELDS = ('websafeConferenceKey', 'websafeConferenceKeys', 'websafeKey',
+              'urlsafeKey', 'SessionKey')
+# request fields holding user ids or personal data
+USER_FIELDS = ('organizerUserId', 'organizerDisplayName', 'displayName', 'mainEmail')
+# request fields that cannot be replayed (cursors embed the app id)
+DROPPED_FIELDS = ('pageToken', 'ifNoneMatch')
+
+
+def anonymizeUser(user_id, salt=None):
+    """Return the anonymized, email-shaped version of a user id."""
+    if not user_id:
+        return user_id
+    salt = settings.TRAFFIC_CAPTURE_SALT if salt is None else salt
+    digest = hashlib.sha1((salt + user_id).encode('utf-8')).hexdigest()[:16]
+    return 'u%s@%s' % (digest, ANONYMOUS_DOMAIN)
+
+
+def anonymizePairs(pairs, salt=None):
+    """Return a key path with its Profile ids anonymized."""
+    return [[kind, anonymizeUser(id_, salt) if kind == 'Profile' else id_]
+            for kind, id_ in pairs]
+
+
+def _encodeKey(wsck, salt=None):
+    try:
+        return {'$key': anonymizePairs(ndb.Key(urlsafe=wsck).pairs(), salt)}
+    except Exception:
+        return wsck
+
+
+def anonymizeRequest(request):
+    """Return the JSON dict of a request message, anonymized."""
+    data = json.loads(protojson.encode_message(request))
+    for name in KEY_FIELDS:
+        if isinstance(data.get(name), list):
+            data[name] = [_encodeKey(wsck) for wsck in data[name]]
+        elif data.get(name):
+            data[name] = _encodeKey(data[name])
+    for name in USER_FIELDS:
+        if data.get(name):
+            data[name] = anonymizeUser(data[name])
+    for name in DROPPED_FIELDS:
+        data.pop(name, None)
+    # batch forms nest the same fields one level down
+    for item in data.get('items', []):
+        for name in USER_FIELDS:
+            if item.get(name):
+                item[name] = anonymizeUser(item[name])
+        for name in KEY_FIELDS:
+            if item.get(name):
+                item[name] = _encodeKey(item[name])
+    return data
+
+
+def _caller():
+    user = endpoints.get_current_user()
+    return anonymizeUser(user.email()) if user else None
+
+
+def _record(method, request, started, latency, outcome):
+    try:
+        entry = {
+            'method': method,
+            'request': anonymizeRequest(request),
+            'user': _caller(),
+            'started': round(started, 3),
+            'latencyMs': round(latency * 1000, 1),
+            'outcome': outcome,
+        }
+    except Exception:
+        logging.exception('Could not capture a %s call', method)
+        return
+    logging.info(LOG_PREFIX + json.dumps(entry, sort_keys=True, separators=(',', ':')))
+
+
+def _recorded(name, method):
+    """Wrap an endpoint method to capture a sample of its calls."""
+    @functools.wraps(method)
+    def wrapper(self, request):
+        if settings.TRAFFIC_CAPTURE_RATE <= 0 or \
+                random.random() >= settings.TRAFFIC_CAPTURE_RATE:
+            return method(self, request)
+        started = time.time()
+        outcome = 'ok'
+        try:
+            return method(self, request)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            _record(name, request, started, time.time() - started, outcome)
+    return wrapper
+
+
+def recorded(cls):
+    """Class decorator capturing the calls of every endpoint method of a
+    remote.Service; place it below @endpoints.api.
+
+    The wrappers keep the remote method attributes, so ProtoRPC still
+    dispatches to them by name.
+    """
+    for name, attr in cls.__dict__.items():
+        if hasattr(attr, 'remote'):
+            setattr(cls, name, _recorded(name, attr))
+    return cls
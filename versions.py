@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""versions.py
+
+Conference Central version tags of API resources, kept in memcache.
+
+Each resource scope (a conference, the session list of a conference, a
+profile, the announcement, the featured speaker) has a random version
+token that the code writing the data replaces after the write commits.
+Read endpoints compare the client's ETag with the current tokens before
+touching the datastore. A token lost from memcache is simply replaced by
+a new one, which only costs the client one full response.
+
+"""
+
+import uuid
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_VERSION_TPL = 'VERSION:%s'
+ANNOUNCEMENT_SCOPE = 'announcement'
+FEATURED_SPEAKER_SCOPE = 'featuredSpeaker'
+FACETS_SCOPE = 'facets'
+
+
+def conferenceScope(c_key):
+    """Return the version scope of a conference."""
+    return 'conference:%s' % c_key.urlsafe()
+
+
+def sessionsScope(c_key):
+    """Return the version scope of the sessions of a conference."""
+    return 'sessions:%s' % c_key.urlsafe()
+
+
+def profileScope(user_id):
+    """Return the version scope of a profile."""
+    return 'profile:%s' % user_id
+
+
+def _newToken():
+    return uuid.uuid4().hex[:12]
+
+
+def bump(*scopes):
+    """Give scopes new versions once the current transaction commits."""
+    def setVersions():
+        memcache.set_multi(dict(
+            (MEMCACHE_VERSION_TPL % scope, _newToken()) for scope in scopes))
+    # outside a transaction the callback runs immediately
+    ndb.get_context().call_on_commit(setVersions)
+
+
+def addToken(scope):
+    """Give a scope without a version one, returning its current token."""
+    key = MEMCACHE_VERSION_TPL % scope
+    memcache.add(key, _newToken())
+    # another request may have raced us to add a token; use its one
+    return memcache.get(key)
+
+
+def etag(scopes, variant=None):
+    """Return the ETag of a response built from scopes.
+
+    variant distinguishes different renderings (views, encodings) of the
+    same data.
+    """
+    keys = [MEMCACHE_VERSION_TPL % scope for scope in scopes]
+    tokens = memcache.get_multi(keys)
+    missing = dict((key, _newToken()) for key in keys if key not in tokens)
+    if missing:
+        # another request may have raced us to add a token; use its one
+        memcache.add_multi(missing)
+        tokens.update(missing)
+        tokens.update(memcache.get_multi(missing.keys()))
+    tag = '-'.join(tokens[key] for key in keys)
+    if variant:
+        tag = '%s:%s' % (tag, variant)
+    return '"%s"' % tag